@@ -79,6 +79,22 @@ class BetamaxAdapter(BaseAdapter):
             'allow_playback_repeats'
             )
 
+        cassette_options['journal'] = self.options.get('journal')
+
+        cassette_options['cache_dir'] = self.options.get('cache_dir')
+
+        cassette_options['blob_threshold'] = self.options.get(
+            'blob_threshold'
+            )
+
+        cassette_options['sidecar_bodies'] = self.options.get(
+            'sidecar_bodies'
+            )
+
+        cassette_options['compression_level'] = self.options.get(
+            'compression_level'
+            )
+
         cassette_options['record_mode'] = self.options.get('record')
 
         for option, value in list(cassette_options.items()):
@@ -113,14 +129,12 @@ class BetamaxAdapter(BaseAdapter):
         :param request request: request
         :returns: A Response object
         """
-        interaction = None
         current_cassette = self.cassette
 
         if not current_cassette:
             raise BetamaxError('No cassette was specified or found.')
 
-        if current_cassette.interactions:
-            interaction = current_cassette.find_match(request)
+        interaction = current_cassette.find_match(request)
 
         if not interaction and current_cassette.is_recording():
             interaction = self.send_and_record(
@@ -131,7 +145,7 @@ class BetamaxAdapter(BaseAdapter):
             raise BetamaxError(unhandled_request_message(request,
                                                          current_cassette))
 
-        resp = interaction.as_response()
+        resp = interaction.as_response(stream)
         resp.connection = self
         return resp
 
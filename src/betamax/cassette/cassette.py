@@ -2,14 +2,17 @@
 import collections
 from datetime import datetime
 from functools import partial
-import os.path
+import threading
 
-from .interaction import Interaction
+from .interaction import Interaction, PlaybackState, _relocated
 
 from .. import matchers
 from .. import serializers
-from betamax.util import (_option_from, serialize_prepared_request,
-                          serialize_response, timestamp)
+from ..serializers.blobs import BlobStore
+from ..serializers.cache import CassetteCache
+from betamax.util import (Replacements, _option_from,
+                          serialize_prepared_request, serialize_response,
+                          timestamp)
 
 
 class Cassette(object):
@@ -21,6 +24,11 @@ class Cassette(object):
         'placeholders': [],
         'preserve_exact_body_bytes': False,
         'allow_playback_repeats': False,
+        'journal': False,
+        'compression_level': None,
+        'cache_dir': None,
+        'blob_threshold': None,
+        'sidecar_bodies': False,
     }
 
     hooks = collections.defaultdict(list)
@@ -39,15 +47,37 @@ class Cassette(object):
         # Retrieve the serializer for this cassette
         self.serializer = serializers.SerializerProxy.find(
             serialization_format, kwargs.get('cassette_library_dir'),
-            cassette_name
+            cassette_name,
+            _option_from('compression_level', kwargs, defaults)
             )
         self.cassette_path = self.serializer.cassette_path
 
+        # Keep the deserialized cassette around to skip parsing it next time
+        cache_dir = _option_from('cache_dir', kwargs, defaults)
+        if cache_dir is not None:
+            self.serializer.cache = CassetteCache(cache_dir)
+
+        # Bodies larger than this many bytes are saved once in the blob store
+        # and cassettes only refer to them
+        self.blob_threshold = _option_from('blob_threshold', kwargs, defaults)
+
+        # Append response bodies to a file next to the cassette which is
+        # memory-mapped when they are replayed
+        self.sidecar_bodies = _option_from('sidecar_bodies', kwargs, defaults)
+
+        sidecar_path = None
+        if not self.serializer.stores_cassettes:
+            sidecar_path = '{0}.bodies'.format(self.cassette_path)
+        self.blob_store = BlobStore(self.serializer.cassette_library_dir,
+                                    self.serializer.archive_path,
+                                    sidecar_path)
+
         # Determine which placeholders to use
         default_placeholders = defaults['placeholders'][:]
         cassette_placeholders = kwargs.get('placeholders', [])
         self.placeholders = merge_placeholder_lists(default_placeholders,
                                                     cassette_placeholders)
+        self._replacements = {}
 
         # Determine whether to preserve exact body bytes
         self.preserve_exact_body_bytes = _option_from(
@@ -58,12 +88,33 @@ class Cassette(object):
             'allow_playback_repeats', kwargs, defaults
             )
 
+        # Append recorded interactions to a journal rather than rewriting
+        # the whole cassette when it is ejected
+        self.journal = _option_from('journal', kwargs, defaults)
+
+        # Number of interactions which are only in the journal
+        self._journaled = 0
+
+        # Which interactions were used, ignored or replaced. This is the
+        # only state playback changes, so cassettes may share the data of
+        # their interactions.
+        self._state = PlaybackState()
+
+        # Serializes finding and recording interactions between threads
+        # replaying through the same cassette
+        self._lock = threading.RLock()
+
         # Initialize the interactions
         self.interactions = []
 
         # Initialize the match options
         self.match_options = set()
 
+        # Interactions bucketed by the keys of the indexable matchers in use
+        self._index = None
+        self._index_on = None
+        self._index_size = 0
+
         self.load_interactions()
         self.serializer.allow_serialization = self.is_recording()
 
@@ -85,12 +136,12 @@ class Cassette(object):
                     serialize_with
                     ))
 
-        cassette_path = serializer.generate_cassette_name(
-            cassette_library_dir, cassette_name
+        proxy = serializers.SerializerProxy.find(
+            serialize_with, cassette_library_dir, cassette_name
             )
         # Otherwise if we're only replaying responses, we should probably
         # have the cassette the user expects us to load and raise.
-        return os.path.exists(cassette_path) or recording
+        return recording or proxy.exists()
 
     def clear(self):
         # Clear out the interactions
@@ -98,16 +149,52 @@ class Cassette(object):
         # Serialize to the cassette file
         self._save_cassette()
 
+    def compact(self):
+        """Merge the journal into the cassette file.
+
+        Interactions appended to the journal are otherwise only merged the
+        next time the cassette file has to be rewritten. As with ejecting,
+        nothing is written unless the cassette is recording.
+        """
+        if self._journaled:
+            self._modified = True
+        self._save_cassette()
+
     @property
     def earliest_recorded_date(self):
         """The earliest date of all of the interactions this cassette."""
-        if self.interactions:
-            i = sorted(self.interactions, key=lambda i: i.recorded_at)[0]
+        interactions = self.interactions
+        if interactions:
+            # The timestamps are zero-padded ISO 8601 strings so the
+            # earliest one sorts first and only it needs to be parsed.
+            i = min(interactions, key=lambda i: i.data['recorded_at'])
             return i.recorded_at
         return datetime.now()
 
     def eject(self):
-        self._save_cassette()
+        self._save_cassette(expanded=False)
+        self.blob_store.close()
+
+    @property
+    def interactions(self):
+        """The interactions in this cassette.
+
+        Interactions replaced while recording with ``record_mode='all'`` are
+        dropped from this list the next time it is accessed.
+        """
+        if self._state.counts[PlaybackState.REPLACED]:
+            with self._lock:
+                self._compact()
+        return self._interactions
+
+    @interactions.setter
+    def interactions(self, interactions):
+        self._interactions = interactions
+        self._modified = True
+        self._index = None
+        self._state = PlaybackState()
+        for interaction in interactions:
+            interaction.attach(self._state, self.blob_store)
 
     def find_match(self, request):
         """Find a matching interaction based on the matchers and request.
@@ -118,32 +205,49 @@ class Cassette(object):
         :param request: ``requests.PreparedRequest``
         :returns: :class:`~betamax.cassette.Interaction`
         """
+        with self._lock:
+            return self._find_match(request)
+
+    def _find_match(self, request):
+        counts = self._state.counts
         # if we are recording, do not filter by match
         if self.is_recording():
             if ((self.record_mode == 'new_episodes' and
-                 all(i.used is True for i in self.interactions)) or
+                 counts[PlaybackState.USED] ==
+                 len(self._interactions) - counts[PlaybackState.REPLACED]) or
                     self.record_mode in ('once', 'none')):
                 return None
 
-        opts = self.match_options
-        # Curry those matchers
+        selected = [(o, matchers.matcher_registry[o])
+                    for o in sorted(self.match_options)]
+        indexed = tuple((o, m) for (o, m) in selected if m.supports_keys())
+        # Curry the matchers that the index cannot answer for us
         curried_matchers = [
-            partial(matchers.matcher_registry[o].match, request)
-            for o in opts
+            partial(m.match, request)
+            for (o, m) in selected if (o, m) not in indexed
         ]
 
-        for interaction in self.interactions:
-            if not interaction.match(curried_matchers):
+        if indexed:
+            key = tuple(m.request_key(request) for (_, m) in indexed)
+            candidates = self._build_index(indexed).get(key, [])
+        else:
+            candidates = self._interactions
+
+        for interaction in candidates:
+            # Checking the flags is cheaper than matching
+            if not interaction.playable:
                 continue
 
-            if interaction.used or interaction.ignored:
+            if not interaction.match(curried_matchers):
                 continue
 
             # If the interaction matches everything
             if self.record_mode == 'all':
                 # If we're recording everything and there's a matching
-                # interaction we want to overwrite it, so we remove it.
-                self.interactions.remove(interaction)
+                # interaction we want to overwrite it. Mark it as replaced
+                # now and drop it from the list the next time it is read.
+                interaction.replaced = True
+                self._modified = True
                 break
 
             # set interaction as used before returning
@@ -171,22 +275,64 @@ class Cassette(object):
             self.serialized = self.serializer.deserialize()
 
         interactions = self.serialized.get('http_interactions', [])
+        if Cassette.hooks['before_playback']:
+            # The deserialized data may be shared with other cassettes so
+            # hooks get a copy they are free to modify
+            interactions = _copy_structure(interactions)
+        journaled = self.serializer.read_journal()
+        if journaled:
+            # Interactions recorded with a journal are part of the cassette
+            # even if they never made it into the cassette file.
+            interactions = interactions + journaled
+            self.serialized = dict(self.serialized,
+                                   http_interactions=interactions)
+        self._journaled = len(journaled)
         self.interactions = [Interaction(i) for i in interactions]
 
-        for i in self.interactions:
+        replacements = self._placeholder_replacements(False)
+        for i in self._interactions:
             dispatch_hooks('before_playback', i, self)
-            i.replace_all(self.placeholders, False)
+            i.expand(replacements)
+        self._modified = False
 
     def sanitize_interactions(self):
+        """Substitute placeholders in the interactions before saving them.
+
+        :returns: whether any of the interactions changed
+        """
+        replacements = self._placeholder_replacements(True)
+        changed = False
         for i in self.interactions:
-            i.replace_all(self.placeholders, True)
+            changed = i.sanitize(replacements) or changed
+        # The recorded requests may have changed under their match keys
+        self._index = None
+        return changed
 
     def save_interaction(self, response, request):
         serialized_data = self.serialize_interaction(response, request)
         interaction = Interaction(serialized_data, response)
+        # The body may already be in the store even if this is ignored
+        interaction.blob_store = self.blob_store
         dispatch_hooks('before_record', interaction, self)
-        if not interaction.ignored:  # If a hook caused this to be ignored
-            self.interactions.append(interaction)
+        if interaction.ignored:  # If a hook caused this to be ignored
+            return interaction
+        with self._lock:
+            self._interactions.append(interaction)
+            interaction.attach(self._state, self.blob_store)
+            if self._index is not None:
+                self._add_to_index(interaction)
+            appendable = self.serializer.appendable
+            if ((self.journal or appendable) and
+                    self.serializer.allow_serialization):
+                replacements = self._placeholder_replacements(True)
+                self.serializer.append(
+                    self._with_blobs(interaction.sanitized(replacements)),
+                    sync=self.journal == 'fsync'
+                )
+                if not appendable:
+                    self._journaled += 1
+            else:
+                self._modified = True
         return interaction
 
     def serialize_interaction(self, response, request):
@@ -197,21 +343,144 @@ class Cassette(object):
                 ),
             'response': serialize_response(
                 response,
-                self.preserve_exact_body_bytes
+                self.preserve_exact_body_bytes,
+                self._body_recorder(response)
                 ),
             'recorded_at': timestamp(),
         }
 
     # Private methods
-    def _save_cassette(self):
+    def _placeholder_replacements(self, serializing):
+        """Return the placeholders compiled for (de)serializing.
+
+        The compiled replacements are cached until the placeholders change.
+        """
+        placeholders = tuple(self.placeholders)
+        cached = self._replacements.get(serializing)
+        if cached is None or cached[0] != placeholders:
+            cached = (placeholders, Replacements(
+                p.unpack(serializing) for p in placeholders
+            ))
+            self._replacements[serializing] = cached
+        return cached[1]
+
+    def _build_index(self, indexed):
+        """Bucket the interactions by the keys of the indexed matchers.
+
+        The buckets preserve the order of ``self.interactions`` so walking a
+        bucket yields the same first match a linear scan would.
+        """
+        if (self._index is None or self._index_on != indexed or
+                self._index_size != len(self._interactions)):
+            self._index = {}
+            self._index_on = indexed
+            self._index_size = 0
+            for interaction in self._interactions:
+                self._add_to_index(interaction)
+        return self._index
+
+    def _add_to_index(self, interaction):
+        key = tuple(interaction.match_key(m) for (_, m) in self._index_on)
+        self._index.setdefault(key, []).append(interaction)
+        self._index_size += 1
+
+    def _compact(self):
+        self._interactions = [i for i in self._interactions
+                              if not i.replaced]
+        self._state = PlaybackState()
+        for interaction in self._interactions:
+            interaction.attach(self._state, self.blob_store)
+        # Replaced interactions are still in the buckets but they keep
+        # their flags in the previous state and are skipped, so the index
+        # remains valid.
+        self._index_size = len(self._interactions)
+
+    def _body_recorder(self, response):
+        """Return how to store a response body while it is received.
+
+        Bodies which ``before_record`` hooks or placeholders may have to
+        change, or keep off disk, are read whole and only stored once the
+        cassette is saved.
+        """
+        sidecar = (self.sidecar_bodies and
+                   self.blob_store.sidecar_path is not None)
+        if ((self.blob_threshold is None and not sidecar) or
+                not self.serializer.allow_serialization or
+                Cassette.hooks['before_record']):
+            return None
+        if self.placeholders and not (
+                self.preserve_exact_body_bytes or
+                'gzip' in response.headers.get('Content-Encoding', '')):
+            return None
+        return partial(self.blob_store.record,
+                       threshold=self.blob_threshold,
+                       sidecar=sidecar)
+
+    def _with_blobs(self, interaction_data):
+        """Move a response body into the blob store before saving."""
+        if ((self.blob_threshold is None and not self.sidecar_bodies) or
+                not self.serializer.allow_serialization):
+            return interaction_data
+        response = interaction_data['response']
+        body = response['body']
+        if (isinstance(body, dict) and self._placeholder_replacements(
+                False).search(body.get('string', ''))):
+            # Placeholders are only substituted in the cassette itself
+            return interaction_data
+        stored = body
+        if self.blob_threshold is not None:
+            stored = self.blob_store.stored_body(body, self.blob_threshold)
+        if stored is body and self.sidecar_bodies and (
+                self.blob_store.sidecar_path is not None):
+            stored = self.blob_store.sidecar_body(body)
+        if stored is body:
+            return interaction_data
+        return dict(interaction_data, response=dict(response, body=stored))
+
+    def _save_cassette(self, expanded=True):
+        """Save the interactions with their placeholders substituted.
+
+        :param bool expanded: whether the interactions keep their data with
+            the placeholders expanded, since they may still be replayed,
+            e.g., after :meth:`compact`, or go back to their saved form
+        """
         from .. import __version__
-        self.sanitize_interactions()
+        if expanded:
+            replacements = self._placeholder_replacements(True)
+            changed = False
+            interactions = []
+            for i in self.interactions:
+                saved, saved_changed = i.saved_form(replacements)
+                changed = saved_changed or changed
+                interactions.append(saved)
+        else:
+            changed = self.sanitize_interactions()
+            interactions = [i.data for i in self.interactions]
+        if not (changed or self._modified or self.is_empty()):
+            # The file already holds exactly these interactions
+            return
+
+        interactions = [self._with_blobs(data) for data in interactions]
+        if (self.serializer.allow_serialization and
+                self.blob_store.sidecar_path is not None):
+            # Drop the bodies of interactions which were recorded over
+            moved = self.blob_store.rewrite_sidecar(
+                data['response']['body'] for data in interactions
+            )
+            if moved:
+                for i in self.interactions:
+                    i.relocate_body(moved)
+                interactions = [_relocated(data, moved)
+                                for data in interactions]
 
         cassette_data = {
-            'http_interactions': [i.data for i in self.interactions],
+            'http_interactions': interactions,
             'recorded_with': 'betamax/{0}'.format(__version__)
         }
         self.serializer.serialize(cassette_data)
+        if self.serializer.allow_serialization:
+            self._modified = False
+            self._journaled = 0
 
 
 class Placeholder(collections.namedtuple('Placeholder',
@@ -238,6 +507,19 @@ def merge_placeholder_lists(defaults, overrides):
                            if p.placeholder in overrides_dict]
 
 
+def _copy_structure(obj):
+    """Copy the dicts and lists of deserialized data.
+
+    Everything else is immutable, or treated as such like the memoryviews
+    of the binary serializer, which cannot be deep-copied, and is shared.
+    """
+    if isinstance(obj, dict):
+        return {k: _copy_structure(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_structure(v) for v in obj]
+    return obj
+
+
 def dispatch_hooks(hook_name, *args):
     """Dispatch registered hooks."""
     # Cassette.hooks is a dictionary that defaults to an empty list,
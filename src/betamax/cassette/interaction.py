@@ -1,7 +1,9 @@
 from requests.cookies import extract_cookies_to_jar
 from datetime import datetime
+import collections
 
 from betamax import util
+from betamax.serializers import blobs
 
 
 class Interaction(object):
@@ -24,9 +26,22 @@ class Interaction(object):
     def __init__(self, interaction, response=None):
         self.data = interaction
         self.orig_response = response
-        self.recorded_response = self.deserialize()
-        self.used = False
-        self.ignored = False
+        self._recorded_response = None
+        #: :class:`~betamax.serializers.blobs.BlobStore` holding the bodies
+        #: this interaction refers to
+        self.blob_store = None
+        # Whether the interaction was used, ignored or replaced is kept by
+        # the cassette it belongs to. Until then it has a state of its own.
+        self._state = PlaybackState()
+        self._position = self._state.append()
+        self._match_keys = {}
+        # The data as it is (or will be) saved in the cassette, i.e., with
+        # placeholders. This is None until the interaction is loaded from
+        # or saved to a cassette and again after it is modified.
+        self._saved = None
+        # Whether self.data may be modified in place. Data loaded from a
+        # cassette may be shared with other cassettes and is copied first.
+        self._owns_data = True
 
     def ignore(self):
         """Ignore this interaction.
@@ -36,18 +51,81 @@ class Interaction(object):
         """
         self.ignored = True
 
-    def as_response(self):
-        """Return the Interaction as a Response object."""
-        self.recorded_response = self.deserialize()
-        return self.recorded_response
+    @property
+    def dirty(self):
+        """Whether the interaction differs from its saved form."""
+        return self._saved is None
+
+    @property
+    def used(self):
+        """Whether this interaction has been played back."""
+        return self._state.is_set(self._position, PlaybackState.USED)
+
+    @used.setter
+    def used(self, value):
+        self._state.set(self._position, PlaybackState.USED, value)
+
+    @property
+    def ignored(self):
+        """Whether this interaction was ignored by a hook."""
+        return self._state.is_set(self._position, PlaybackState.IGNORED)
+
+    @ignored.setter
+    def ignored(self, value):
+        self._state.set(self._position, PlaybackState.IGNORED, value)
+
+    @property
+    def replaced(self):
+        """Whether this interaction was replaced by a new recording."""
+        return self._state.is_set(self._position, PlaybackState.REPLACED)
+
+    @replaced.setter
+    def replaced(self, value):
+        self._state.set(self._position, PlaybackState.REPLACED, value)
+
+    @property
+    def playable(self):
+        """Whether this interaction is neither used, ignored nor replaced."""
+        return not self._state.flags[self._position]
+
+    def attach(self, state, blob_store=None):
+        """Move this interaction's playback flags into ``state``.
+
+        Bodies which were saved in a blob store are read from ``blob_store``.
+        """
+        flags = self._state.flags[self._position]
+        self._state = state
+        self._position = state.append(flags)
+        self.blob_store = blob_store
+
+    def as_response(self, stream=False):
+        """Return the Interaction as a Response object.
+
+        :param bool stream: whether the body will be streamed, in which case
+            it is decoded as it is read rather than all at once
+        """
+        self._recorded_response = self.deserialize(stream)
+        return self._recorded_response
+
+    @property
+    def recorded_response(self):
+        """The most recently built Response for this Interaction.
+
+        Responses are only built when they are needed, i.e., when the
+        interaction is replayed or this attribute is first accessed.
+        """
+        if self._recorded_response is None:
+            self._recorded_response = self.deserialize()
+        return self._recorded_response
 
     @property
     def recorded_at(self):
         return datetime.strptime(self.data['recorded_at'], '%Y-%m-%dT%H:%M:%S')
 
-    def deserialize(self):
+    def deserialize(self, stream=False):
         """Turn a serialized interaction into a Response."""
-        r = util.deserialize_response(self.data['response'])
+        r = util.deserialize_response(self.data['response'], self.blob_store,
+                                      stream)
         r.request = util.deserialize_prepared_request(self.data['request'])
         extract_cookies_to_jar(r.cookies, r.request, r.raw)
         return r
@@ -57,51 +135,234 @@ class Interaction(object):
         request = self.data['request']
         return all(m(request) for m in matchers)
 
+    def match_key(self, matcher):
+        """Return the matcher's key for the recorded request.
+
+        Keys are computed once per matcher and reused until the recorded
+        request is modified by a replacement.
+        """
+        try:
+            return self._match_keys[matcher]
+        except KeyError:
+            key = matcher.recorded_request_key(self.data['request'])
+            self._match_keys[matcher] = key
+            return key
+
+    def expand(self, replacements):
+        """Substitute placeholders after loading the interaction.
+
+        The loaded data is kept as the saved form of the interaction and the
+        substitutions are made in a copy of it.
+        """
+        self._saved = self.data
+        self._owns_data = False
+        if replacements:
+            self._apply(replacements)
+
+    def sanitize(self, replacements):
+        """Substitute placeholders before saving the interaction.
+
+        Interactions which were not modified since they were loaded go back
+        to their saved form unless it contains text that must be replaced.
+
+        :returns: whether the saved form of the interaction changed
+        """
+        saved, changed = self.saved_form(replacements)
+        self.data = saved
+        self._owns_data = False
+        self._match_keys.clear()
+        return changed
+
+    def sanitized(self, replacements):
+        """Return the saved form of the interaction without modifying it.
+
+        The returned data is remembered as the saved form so that the
+        interaction is not considered changed when the cassette is saved.
+        """
+        return self.saved_form(replacements)[0]
+
+    def saved_form(self, replacements):
+        """Return the saved form of the interaction and whether it changed.
+
+        The saved form is reused while the interaction is unmodified and the
+        saved form holds no text that must be replaced. Otherwise it is made
+        again from a copy of the data, which is left as it is.
+        """
+        saved = self._saved
+        if saved is not None and not any(
+                replacements.search(text) for text in _text_fields(saved)):
+            return saved, False
+        saved = self.data
+        if replacements:
+            saved = _copy_for_write(saved)
+            Interaction(saved)._apply(replacements)
+        self._saved = saved
+        return saved, True
+
+    def relocate_body(self, moved):
+        """Update the response body's offset after the sidecar was rewritten.
+
+        :param dict moved: what
+            :meth:`~betamax.serializers.blobs.BlobStore.rewrite_sidecar`
+            returned
+        """
+        saved = self._saved
+        self.data = _relocated(self.data, moved)
+        if saved is not None:
+            self._saved = _relocated(saved, moved)
+
     def replace(self, text_to_replace, placeholder):
         """Replace sensitive data in this interaction."""
-        self.replace_in_headers(text_to_replace, placeholder)
-        self.replace_in_body(text_to_replace, placeholder)
-        self.replace_in_uri(text_to_replace, placeholder)
+        self.replace_all(
+            util.Replacements([(text_to_replace, placeholder)]), False
+        )
 
     def replace_all(self, replacements, serializing):
-        """Easy way to accept all placeholders registered."""
-        for placeholder in replacements:
-            self.replace(*placeholder.unpack(serializing))
+        """Easy way to accept all placeholders registered.
+
+        ``replacements`` is either a list of placeholders, which are unpacked
+        according to ``serializing``, or a compiled
+        :class:`~betamax.util.Replacements` instance.
+        """
+        if not isinstance(replacements, util.Replacements):
+            replacements = util.Replacements(
+                p.unpack(serializing) for p in replacements
+            )
+        if not replacements:
+            return
+        self._saved = None
+        self._apply(replacements)
 
     def replace_in_headers(self, text_to_replace, placeholder):
+        self._replace_in_one(self._replace_in_headers, text_to_replace,
+                             placeholder)
+
+    def replace_in_body(self, text_to_replace, placeholder):
+        self._replace_in_one(self._replace_in_body, text_to_replace,
+                             placeholder)
+
+    def replace_in_uri(self, text_to_replace, placeholder):
+        self._replace_in_one(self._replace_in_uri, text_to_replace,
+                             placeholder)
+
+    def _apply(self, replacements):
+        self._match_keys.clear()
+        self._make_writable()
+        self._replace_in_headers(replacements)
+        self._replace_in_body(replacements)
+        self._replace_in_uri(replacements)
+
+    def _replace_in_one(self, replace_in, text_to_replace, placeholder):
         if text_to_replace == '':
             return
+        self._saved = None
+        self._match_keys.clear()
+        self._make_writable()
+        replace_in(util.Replacements([(text_to_replace, placeholder)]))
+
+    def _make_writable(self):
+        if not self._owns_data:
+            self.data = _copy_for_write(self.data)
+            self._owns_data = True
+
+    def _replace_in_headers(self, replacements):
         for obj in ('request', 'response'):
             headers = self.data[obj]['headers']
             for k, v in list(headers.items()):
                 if isinstance(v, list):
-                    headers[k] = [hv.replace(text_to_replace, placeholder)
-                                  for hv in v]
+                    headers[k] = [replacements.apply(hv) for hv in v]
                 else:
-                    headers[k] = v.replace(text_to_replace, placeholder)
+                    headers[k] = replacements.apply(v)
 
-    def replace_in_body(self, text_to_replace, placeholder):
-        if text_to_replace == '':
-            return
+    def _replace_in_body(self, replacements):
         for obj in ('request', 'response'):
             body = self.data[obj]['body']
             old_style = hasattr(body, 'replace')
             if not old_style:
                 body = body.get('string', '')
 
-            if text_to_replace in body:
-                body = body.replace(text_to_replace, placeholder)
+            body = replacements.apply(body)
             if old_style:
                 self.data[obj]['body'] = body
             else:
                 self.data[obj]['body']['string'] = body
 
-    def replace_in_uri(self, text_to_replace, placeholder):
-        if text_to_replace == '':
-            return
+    def _replace_in_uri(self, replacements):
         for (obj, key) in (('request', 'uri'), ('response', 'url')):
-            uri = self.data[obj][key]
-            if text_to_replace in uri:
-                self.data[obj][key] = uri.replace(
-                    text_to_replace, placeholder
-                )
+            self.data[obj][key] = replacements.apply(self.data[obj][key])
+
+
+class PlaybackState(object):
+    """The playback flags of a sequence of interactions.
+
+    Flags are stored in a ``bytearray`` with one byte per interaction and
+    how many interactions have each flag set is counted as they change, so
+    nobody needs to walk the interactions to find out.
+    """
+
+    USED = 1
+    IGNORED = 2
+    REPLACED = 4
+
+    def __init__(self):
+        self.flags = bytearray()
+        self.counts = collections.Counter()
+
+    def __len__(self):
+        return len(self.flags)
+
+    def append(self, flags=0):
+        """Add an interaction with ``flags`` and return its position."""
+        self.flags.append(flags)
+        for flag in (self.USED, self.IGNORED, self.REPLACED):
+            if flags & flag:
+                self.counts[flag] += 1
+        return len(self.flags) - 1
+
+    def is_set(self, position, flag):
+        return bool(self.flags[position] & flag)
+
+    def set(self, position, flag, value=True):
+        current = self.flags[position]
+        if bool(current & flag) == bool(value):
+            return
+        if value:
+            self.flags[position] = current | flag
+            self.counts[flag] += 1
+        else:
+            self.flags[position] = current & ~flag
+            self.counts[flag] -= 1
+
+
+def _copy_for_write(data):
+    """Copy the parts of an interaction that replacements modify."""
+    data = dict(data)
+    for obj in ('request', 'response'):
+        section = data[obj] = dict(data[obj])
+        section['headers'] = dict(section['headers'])
+        if isinstance(section['body'], dict):
+            section['body'] = dict(section['body'])
+    return data
+
+
+def _relocated(data, moved):
+    response = data['response']
+    body = blobs.relocated(response['body'], moved)
+    if body is response['body']:
+        return data
+    return dict(data, response=dict(response, body=body))
+
+
+def _text_fields(data):
+    """Yield the text of an interaction that replacements apply to."""
+    for obj in ('request', 'response'):
+        for value in data[obj]['headers'].values():
+            if isinstance(value, list):
+                for v in value:
+                    yield v
+            else:
+                yield value
+        body = data[obj]['body']
+        yield body if hasattr(body, 'replace') else body.get('string', '')
+    yield data['request']['uri']
+    yield data['response']['url']
@@ -1,6 +1,8 @@
 from collections import defaultdict
 
 from .cassette import Cassette
+from . import serializers
+from .serializers.cache import memory_cache
 
 
 class Configuration(object):
@@ -130,6 +132,49 @@ class Configuration(object):
     def cassette_library_dir(self, value):
         Configuration.CASSETTE_LIBRARY_DIR = value
 
+    @property
+    def max_cached_cassettes(self):
+        """Retrieve and set how many parsed cassettes are kept in memory.
+
+        Cassettes loaded more than once by the same process, e.g., by
+        parametrized tests, are only parsed the first time. Setting this to
+        ``0`` disables the cache.
+        """
+        return memory_cache.max_entries
+
+    @max_cached_cassettes.setter
+    def max_cached_cassettes(self, value):
+        memory_cache.max_entries = value
+        memory_cache.clear()
+
+    @property
+    def max_cached_cassette_bytes(self):
+        """Retrieve and set the total size of the cassettes kept in memory.
+
+        This is measured by the size of the cassette files.
+        """
+        return memory_cache.max_bytes
+
+    @max_cached_cassette_bytes.setter
+    def max_cached_cassette_bytes(self, value):
+        memory_cache.max_bytes = value
+        memory_cache.clear()
+
+    @property
+    def json_backend(self):
+        """Retrieve and set the library used by the JSON serializer.
+
+        This is one of ``'orjson'``, ``'ujson'``, ``'simdjson'`` or
+        ``'json'``. By default cassettes are written by ``'json'`` and read
+        by the first of those which is installed, and this is ``'json'``.
+        Setting it to ``None`` restores the default.
+        """
+        return serializers.serializer_registry['json'].backend.name
+
+    @json_backend.setter
+    def json_backend(self, value):
+        serializers.serializer_registry['json'].use_backend(value)
+
     @property
     def default_cassette_options(self):
         """Retrieve and set the default cassette options.
@@ -19,6 +19,18 @@ class BodyBytesValidationError(ValidationError):
     pass
 
 
+class CacheDirValidationError(ValidationError):
+    pass
+
+
+class CompressionLevelValidationError(ValidationError):
+    pass
+
+
+class JournalValidationError(ValidationError):
+    pass
+
+
 class MatchersValidationError(ValidationError):
     pass
 
@@ -43,13 +55,26 @@ class SerializerValidationError(ValidationError):
     pass
 
 
+class BlobThresholdValidationError(ValidationError):
+    pass
+
+
+class SidecarBodiesValidationError(ValidationError):
+    pass
+
+
 validation_error_map = {
     'allow_playback_repeats': PlaybackRepeatsValidationError,
+    'blob_threshold': BlobThresholdValidationError,
+    'cache_dir': CacheDirValidationError,
+    'compression_level': CompressionLevelValidationError,
+    'journal': JournalValidationError,
     'match_requests_on': MatchersValidationError,
     'record': RecordValidationError,
     'placeholders': PlaceholdersValidationError,
     'preserve_exact_body_bytes': BodyBytesValidationError,
     're_record_interval': RecordIntervalValidationError,
     'serialize': SerializerValidationError,  # TODO: Remove this
-    'serialize_with': SerializerValidationError
+    'serialize_with': SerializerValidationError,
+    'sidecar_bodies': SidecarBodiesValidationError,
 }
@@ -31,6 +31,27 @@ class BaseMatcher(object):
     - body
     - headers
 
+    Matchers which compare a single property of the request can also
+    implement :meth:`request_key` and :meth:`recorded_request_key`. When both
+    are implemented, Betamax uses them to look up the matching recorded
+    requests directly instead of calling ``match`` on every one of them:
+
+    .. code-block:: python
+
+        class ContentTypeMatcher(BaseMatcher):
+            name = 'content-type'
+
+            def match(self, request, recorded_request):
+                return (self.request_key(request) ==
+                        self.recorded_request_key(recorded_request))
+
+            def request_key(self, request):
+                return request.headers.get('Content-Type')
+
+            def recorded_request_key(self, recorded_request):
+                value = recorded_request['headers'].get('Content-Type')
+                return value[0] if isinstance(value, list) else value
+
     """
 
     name = None
@@ -60,3 +81,44 @@ class BaseMatcher(object):
         """
         raise NotImplementedError('The match method must be implemented on'
                                   ' %s' % self.__class__.__name__)
+
+    def request_key(self, request):
+        """An optional method returning a hashable key for a live request.
+
+        The key must be equal to the :meth:`recorded_request_key` of a
+        recorded request exactly when :meth:`match` would return ``True`` for
+        the pair. Sub-classes of a matcher which implements this that
+        override ``match`` but not both key methods are not indexed.
+
+        :param PreparedRequest request: A requests PreparedRequest object
+        :returns: a hashable object or ``NotImplemented`` if the matcher
+            does not support keys
+        """
+        return NotImplemented
+
+    def recorded_request_key(self, recorded_request):
+        """An optional method returning a hashable key for a recorded request.
+
+        :param dict recorded_request: A dictionary containing the serialized
+            request in the cassette
+        :returns: a hashable object or ``NotImplemented`` if the matcher
+            does not support keys
+        """
+        return NotImplemented
+
+    def supports_keys(self):
+        """Return whether this matcher implements both key methods.
+
+        The key methods are only trusted if they are defined by the same
+        class as ``match`` or by a sub-class of it, so that sub-classes which
+        only override ``match`` keep working.
+        """
+        mro = type(self).__mro__
+
+        def defined_at(name):
+            return next(i for i, c in enumerate(mro) if name in vars(c))
+
+        keys = max(defined_at('request_key'),
+                   defined_at('recorded_request_key'))
+        return (keys < mro.index(BaseMatcher) and
+                keys <= defined_at('match'))
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import hashlib
+
 from .base import BaseMatcher
 
 from betamax import util
@@ -9,14 +11,30 @@ class BodyMatcher(BaseMatcher):
     name = 'body'
 
     def match(self, request, recorded_request):
-        recorded_request = util.deserialize_prepared_request(recorded_request)
+        request_body = self.to_text(request.body)
+        recorded_body = self.to_text(
+            util.recorded_body(recorded_request['body'])
+        )
+        return recorded_body == request_body
 
-        request_body = b''
-        if request.body:
-            request_body = util.coerce_content(request.body)
+    def request_key(self, request):
+        return self.digest(self.to_text(request.body))
 
-        recorded_body = b''
-        if recorded_request.body:
-            recorded_body = util.coerce_content(recorded_request.body)
+    def recorded_request_key(self, recorded_request):
+        return self.digest(
+            self.to_text(util.recorded_body(recorded_request['body']))
+        )
 
-        return recorded_body == request_body
+    def to_text(self, body):
+        """Coerce a body to the text that is compared."""
+        if not body:
+            return ''
+        return util.coerce_content(body)
+
+    def digest(self, text):
+        """Return a digest of the text or None if it is not text."""
+        if not isinstance(text, str):
+            # Streamed bodies (e.g., files or generators) never match a
+            # recorded body.
+            return None
+        return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).digest()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from .base import BaseMatcher
-from requests.compat import urlparse
+from betamax.util import parse_uri
 
 
 class HostMatcher(BaseMatcher):
@@ -8,6 +8,11 @@ class HostMatcher(BaseMatcher):
     name = 'host'
 
     def match(self, request, recorded_request):
-        request_host = urlparse(request.url).netloc
-        recorded_host = urlparse(recorded_request['uri']).netloc
-        return request_host == recorded_host
+        return (self.request_key(request) ==
+                self.recorded_request_key(recorded_request))
+
+    def request_key(self, request):
+        return parse_uri(request.url).netloc
+
+    def recorded_request_key(self, recorded_request):
+        return parse_uri(recorded_request['uri']).netloc
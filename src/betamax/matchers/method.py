@@ -8,3 +8,9 @@ class MethodMatcher(BaseMatcher):
 
     def match(self, request, recorded_request):
         return request.method == recorded_request['method']
+
+    def request_key(self, request):
+        return request.method
+
+    def recorded_request_key(self, recorded_request):
+        return recorded_request['method']
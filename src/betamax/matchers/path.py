@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from .base import BaseMatcher
-from requests.compat import urlparse
+from betamax.util import parse_uri
 
 
 class PathMatcher(BaseMatcher):
@@ -8,6 +8,11 @@ class PathMatcher(BaseMatcher):
     name = 'path'
 
     def match(self, request, recorded_request):
-        request_path = urlparse(request.url).path
-        recorded_path = urlparse(recorded_request['uri']).path
-        return request_path == recorded_path
+        return (self.request_key(request) ==
+                self.recorded_request_key(recorded_request))
+
+    def request_key(self, request):
+        return parse_uri(request.url).path
+
+    def recorded_request_key(self, recorded_request):
+        return parse_uri(recorded_request['uri']).path
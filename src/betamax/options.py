@@ -14,7 +14,7 @@ def validate_matchers(matchers):
 
 def validate_serializer(serializer):
     from betamax.serializers import serializer_registry
-    return serializer in list(serializer_registry.keys())
+    return serializer in serializer_registry
 
 
 def validate_placeholders(placeholders):
@@ -26,6 +26,25 @@ def validate_placeholders(placeholders):
         return False
 
 
+def validate_journal(journal):
+    return journal in [True, False, 'fsync']
+
+
+def validate_compression_level(level):
+    return level is None or (isinstance(level, int) and
+                             not isinstance(level, bool) and 0 <= level <= 9)
+
+
+def validate_blob_threshold(threshold):
+    return threshold is None or (isinstance(threshold, int) and
+                                 not isinstance(threshold, bool) and
+                                 threshold >= 0)
+
+
+def validate_cache_dir(cache_dir):
+    return cache_dir is None or isinstance(cache_dir, str)
+
+
 def translate_cassette_options():
     for (k, v) in Cassette.default_cassette_options.items():
         yield (k, v) if k != 'record_mode' else ('record', v)
@@ -45,6 +64,11 @@ class Options(object):
         'preserve_exact_body_bytes': isboolean,
         'placeholders': validate_placeholders,
         'allow_playback_repeats': isboolean,
+        'journal': validate_journal,
+        'compression_level': validate_compression_level,
+        'cache_dir': validate_cache_dir,
+        'blob_threshold': validate_blob_threshold,
+        'sidecar_bodies': isboolean,
     }
 
     defaults = {
@@ -56,6 +80,11 @@ class Options(object):
         'preserve_exact_body_bytes': False,
         'placeholders': [],
         'allow_playback_repeats': False,
+        'journal': False,
+        'compression_level': None,
+        'cache_dir': None,
+        'blob_threshold': None,
+        'sidecar_bodies': False,
     }
 
     def __init__(self, data=None):
@@ -1,12 +1,45 @@
 # -*- coding: utf-8 -*-
 from .base import BaseSerializer
+from .binary_serializer import BinarySerializer
+from .compressed import CompressedSerializer, compressors
 from .json_serializer import JSONSerializer
+from .jsonl_serializer import JSONLinesSerializer
 from .proxy import SerializerProxy
+from .sqlite_serializer import SQLiteSerializer
 
-serializer_registry = {}
 
-_serializers = [JSONSerializer]
+class SerializerRegistry(dict):
+    """Registered serializers by name.
+
+    Besides the registered names, this also resolves names such as
+    ``'json+gz'`` to a :class:`CompressedSerializer` wrapping the registered
+    serializer.
+    """
+
+    def __missing__(self, name):
+        base, _, compression = str(name).rpartition('+')
+        if (dict.__contains__(self, base) and compression in compressors and
+                not getattr(self[base], 'stores_cassettes', False)):
+            return CompressedSerializer(self[base], compression)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+serializer_registry = SerializerRegistry()
+
+_serializers = [JSONSerializer, JSONLinesSerializer, BinarySerializer,
+                SQLiteSerializer]
 serializer_registry.update(dict((s.name, s()) for s in _serializers))
 del _serializers
 
-__all__ = ('BaseSerializer', 'JSONSerializer', 'SerializerProxy')
+__all__ = ('BaseSerializer', 'BinarySerializer', 'CompressedSerializer',
+           'JSONSerializer', 'JSONLinesSerializer', 'SerializerProxy',
+           'SQLiteSerializer')
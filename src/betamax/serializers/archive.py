@@ -0,0 +1,116 @@
+import os
+import shutil
+import threading
+import zipfile
+
+# Files in the overlay directory which are not cassettes
+_NOT_PACKED = ('.journal', '.tmp')
+
+_archives = {}
+_lock = threading.Lock()
+
+
+def is_archive(path):
+    """Return whether ``path`` is a zip archive of cassettes."""
+    return (path is not None and os.path.isfile(path) and
+            zipfile.is_zipfile(path))
+
+
+def overlay_directory(archive_path):
+    """Return the directory that cassettes recorded for an archive go to.
+
+    This is the archive's path without its extension, e.g.,
+    ``tests/cassettes`` for ``tests/cassettes.zip``.
+    """
+    root, extension = os.path.splitext(archive_path)
+    return root if extension else archive_path + '.d'
+
+
+def member_name(archive_path, cassette_path):
+    """Return the name in the archive of a cassette in the overlay."""
+    return os.path.relpath(
+        cassette_path, overlay_directory(archive_path)
+    ).replace(os.sep, '/')
+
+
+def open_archive(archive_path):
+    """Return a :class:`zipfile.ZipFile` for reading an archive.
+
+    The archive's central directory is only read again once the archive
+    changes, and the returned object is shared and must not be closed.
+    """
+    stat = os.stat(archive_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _archives.get(archive_path)
+        if cached is None or cached[0] != key:
+            if cached is not None:
+                cached[1].close()
+            cached = _archives[archive_path] = (key,
+                                                zipfile.ZipFile(archive_path))
+    return cached[1]
+
+
+def has_member(archive_path, name):
+    """Return whether the archive has a member called ``name``."""
+    try:
+        open_archive(archive_path).getinfo(name)
+    except KeyError:
+        return False
+    return True
+
+
+def pack(archive_path):
+    """Fold the cassettes recorded into the overlay back into the archive.
+
+    Cassettes in the overlay directory replace the members of the same name
+    and are removed once the new archive is in place. The archive is created
+    if it does not exist yet. Journals are left in the overlay since their
+    interactions are not part of the cassettes yet.
+
+    .. code-block:: python
+
+        from betamax.serializers.archive import pack
+
+        pack('tests/cassettes.zip')
+
+    :param str archive_path: path of the archive
+    :returns: the names of the members that were added or replaced
+    """
+    overlay = overlay_directory(archive_path)
+    paths = {}
+    for directory, _, filenames in os.walk(overlay):
+        for filename in filenames:
+            if filename.endswith(_NOT_PACKED):
+                continue
+            path = os.path.join(directory, filename)
+            paths[member_name(archive_path, path)] = path
+    if not paths:
+        return []
+
+    temporary_path = '{0}.{1}.tmp'.format(archive_path, os.urandom(4).hex())
+    try:
+        with zipfile.ZipFile(temporary_path, 'w',
+                             zipfile.ZIP_DEFLATED) as packed:
+            if os.path.exists(archive_path):
+                with zipfile.ZipFile(archive_path) as existing:
+                    for info in existing.infolist():
+                        if info.filename not in paths:
+                            packed.writestr(info,
+                                            existing.read(info.filename))
+                shutil.copymode(archive_path, temporary_path)
+            for name in sorted(paths):
+                # Sidecars are not compressed so that their bodies can be
+                # read without decompressing everything before them
+                packed.write(paths[name], name,
+                             zipfile.ZIP_STORED if name.endswith('.bodies')
+                             else None)
+        os.replace(temporary_path, archive_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+    for path in paths.values():
+        os.unlink(path)
+    return sorted(paths)
@@ -89,3 +89,31 @@ class BaseSerializer(object):
         :returns: dictionary
         """
         raise NotImplementedError(NOT_IMPLEMENTED_ERROR_MSG)
+
+    def dump(self, cassette_data, fileobj):
+        """Write the serialized cassette data to a file object.
+
+        Betamax always writes cassettes through this method. By default it
+        writes the string returned by :meth:`serialize`. Override it to write
+        the data as it is serialized instead of building a single string.
+
+        :param dict cassette_data: A dictionary with two keys:
+            ``http_interactions``, ``recorded_with``.
+        :param fileobj: The file object opened for writing, in binary mode
+            if ``stored_as_binary`` is ``True``.
+        """
+        fileobj.write(self.serialize(cassette_data))
+
+    def load(self, fileobj):
+        """Read the cassette data from a file object.
+
+        Betamax always reads cassettes through this method. By default it
+        passes the entire contents of the file to :meth:`deserialize`.
+        Override it to parse the file as it is read instead.
+
+        :param fileobj: The file object opened for reading, in binary mode
+            if ``stored_as_binary`` is ``True``.
+        :returns: dictionary in the structure returned by
+            :meth:`deserialize`
+        """
+        return self.deserialize(fileobj.read())
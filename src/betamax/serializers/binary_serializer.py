@@ -0,0 +1,142 @@
+from .base import BaseSerializer
+
+import base64
+import os
+import struct
+
+MAGIC = b'BETAMAX\x01'
+
+_LENGTH = struct.Struct('<I')
+_INTEGER = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+
+
+class BinarySerializer(BaseSerializer):
+    # Serializes and deserializes a cassette to a compact binary format.
+    #
+    # Every value is a one byte tag followed by its payload. Strings, bytes,
+    # lists and dictionaries are prefixed with their length, so bodies are
+    # stored as raw bytes rather than base64 encoded text. When loading, those
+    # bodies are handed back as ``memoryview`` slices of the file's contents
+    # under the ``'bytes'`` key of the body.
+    name = 'binary'
+    stored_as_binary = True
+
+    @staticmethod
+    def generate_cassette_name(cassette_library_dir, cassette_name):
+        return os.path.join(cassette_library_dir,
+                            '{0}.{1}'.format(cassette_name, 'bin'))
+
+    def serialize(self, cassette_data):
+        chunks = [MAGIC]
+        _encode(_with_raw_bodies(cassette_data), chunks.append)
+        return b''.join(chunks)
+
+    def dump(self, cassette_data, fileobj):
+        fileobj.write(MAGIC)
+        _encode(_with_raw_bodies(cassette_data), fileobj.write)
+
+    def deserialize(self, cassette_data):
+        if not cassette_data.startswith(MAGIC):
+            return {}
+        try:
+            value, _ = _decode(memoryview(cassette_data), len(MAGIC))
+        except (IndexError, ValueError, struct.error):
+            value = {}
+        return value
+
+
+def _with_raw_bodies(cassette_data):
+    """Replace base64 encoded bodies with the bytes they encode."""
+    cassette_data = dict(cassette_data)
+    interactions = cassette_data.get('http_interactions', [])
+    cassette_data['http_interactions'] = [
+        _interaction_with_raw_bodies(i) for i in interactions
+    ]
+    return cassette_data
+
+
+def _interaction_with_raw_bodies(interaction):
+    interaction = dict(interaction)
+    for obj in ('request', 'response'):
+        body = interaction[obj]['body']
+        if isinstance(body, dict) and 'base64_string' in body:
+            body = dict(body)
+            body['bytes'] = base64.b64decode(body.pop('base64_string'))
+            interaction[obj] = dict(interaction[obj], body=body)
+    return interaction
+
+
+def _encode(value, write):
+    # bool is checked first since it is a subclass of int
+    if value is None:
+        write(b'N')
+    elif value is True:
+        write(b'T')
+    elif value is False:
+        write(b'F')
+    elif isinstance(value, int):
+        write(b'i' + _INTEGER.pack(value))
+    elif isinstance(value, float):
+        write(b'f' + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8', 'surrogatepass')
+        write(b's' + _LENGTH.pack(len(encoded)))
+        write(encoded)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        write(b'b' + _LENGTH.pack(len(value)))
+        write(value)
+    elif isinstance(value, (list, tuple)):
+        write(b'l' + _LENGTH.pack(len(value)))
+        for item in value:
+            _encode(item, write)
+    elif isinstance(value, dict):
+        write(b'd' + _LENGTH.pack(len(value)))
+        for key, item in value.items():
+            _encode(key, write)
+            _encode(item, write)
+    else:
+        raise TypeError(
+            'Object of type {0} cannot be serialized'.format(
+                type(value).__name__)
+            )
+
+
+def _decode(data, offset):
+    """Decode the value at ``offset`` and return it with the next offset."""
+    tag = data[offset]
+    offset += 1
+    if tag == 0x4e:  # N
+        return None, offset
+    if tag == 0x54:  # T
+        return True, offset
+    if tag == 0x46:  # F
+        return False, offset
+    if tag == 0x69:  # i
+        return _INTEGER.unpack_from(data, offset)[0], offset + 8
+    if tag == 0x66:  # f
+        return _FLOAT.unpack_from(data, offset)[0], offset + 8
+
+    length = _LENGTH.unpack_from(data, offset)[0]
+    offset += 4
+    if tag in (0x73, 0x62):  # s, b
+        end = offset + length
+        if end > len(data):
+            raise ValueError('Truncated value at offset {0}'.format(offset))
+        if tag == 0x62:
+            return data[offset:end], end
+        return str(data[offset:end], 'utf-8', 'surrogatepass'), end
+    if tag == 0x6c:  # l
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == 0x64:  # d
+        items = {}
+        for _ in range(length):
+            key, offset = _decode(data, offset)
+            items[key], offset = _decode(data, offset)
+        return items, offset
+    raise ValueError('Unknown tag {0!r} at offset {1}'.format(
+        chr(tag), offset - 5))
@@ -0,0 +1,512 @@
+from . import archive
+from .compressed import compressors
+from betamax.exceptions import BetamaxError
+from betamax.util import BodyReader
+
+import base64
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+#: Name of the directory in the cassette library holding the blob store
+BLOBS_DIRECTORY = 'blobs'
+
+# How references look in cassettes, whatever their format
+_REFERENCE = re.compile(rb'[0-9a-f]{64}')
+
+# How many bytes of a body are read at a time while recording it
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore(object):
+    """Store bodies outside of the cassettes that refer to them.
+
+    Blobs are files in the ``blobs`` directory of the cassette library,
+    named after the SHA-256 digest of their contents, and bodies in
+    cassettes only hold the digest of their blob, e.g.,
+    ``{"encoding": "utf-8", "sha256": "..."}``.
+
+    Bodies can also be appended to a sidecar file next to the cassette, in
+    which case the cassette holds their offset and length, e.g.,
+    ``{"encoding": "utf-8", "offset": 0, "length": 1024}``.
+
+    Both are memory-mapped when they are replayed so that only the bodies
+    which are actually read are loaded. When the cassette library is a zip
+    archive, blobs and sidecars are also looked up in the archive.
+    """
+
+    def __init__(self, cassette_library_dir, archive_path=None,
+                 sidecar_path=None):
+        self.directory = os.path.join(cassette_library_dir or '',
+                                      BLOBS_DIRECTORY)
+        self.archive_path = archive_path
+        #: Path of the cassette's sidecar file, if it may have one
+        self.sidecar_path = sidecar_path
+        # Offsets of the bodies appended to the sidecar by their digest
+        self._appended = {}
+        # Bodies of concurrent requests are appended one after the other
+        self._sidecar_lock = threading.Lock()
+        # The sidecar's device and inode, its memory map and a view of it
+        self._sidecar_map = None
+        self._map_lock = threading.Lock()
+
+    def path(self, digest):
+        """Return the path of the blob with the given digest."""
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data):
+        """Store ``data`` unless it is stored already.
+
+        :returns: the digest of the data
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path) or self._member(digest) is not None:
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = '{0}.{1}.tmp'.format(path, os.urandom(4).hex())
+        try:
+            with open(temporary_path, 'wb') as fd:
+                fd.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return digest
+
+    def get(self, digest):
+        """Return the contents of a blob.
+
+        :raises: :class:`~betamax.exceptions.BetamaxError` if there is no
+            such blob
+        """
+        with self._open_blob(digest) as fd:
+            return fd.read()
+
+    def open(self, body):
+        """Return a file object reading a body saved by this store.
+
+        :param dict body: the body as saved in the cassette
+        """
+        if 'sha256' in body:
+            return self._open_blob(body['sha256'])
+
+        offset, length = body['offset'], body['length']
+        if self.sidecar_path is not None:
+            view = self._map_sidecar(offset, length)
+            if view is not None:
+                return BodyReader(view)
+            member = self._sidecar_member()
+            if member is not None:
+                with archive.open_archive(self.archive_path).open(
+                        member) as fd:
+                    fd.seek(offset)
+                    return io.BytesIO(fd.read(length))
+        raise BetamaxError('The body at offset {0} of the sidecar {1!r} is '
+                           'missing'.format(offset, self.sidecar_path))
+
+    def close(self):
+        """Release the memory map of the sidecar.
+
+        Responses which are still reading bodies from it keep it mapped until
+        they are closed.
+        """
+        with self._map_lock:
+            self._release_map()
+
+    def stored_body(self, body, threshold):
+        """Return ``body`` with its contents moved into the store.
+
+        Bodies of at most ``threshold`` bytes and bodies which are already
+        stored are returned unchanged.
+        """
+        data = _body_bytes(body)
+        if data is None or len(data) <= threshold:
+            return body
+        return {'encoding': body['encoding'], 'sha256': self.put(data)}
+
+    def sidecar_body(self, body):
+        """Return ``body`` with its contents appended to the sidecar.
+
+        Empty bodies and bodies which are already stored are returned
+        unchanged. Bodies are appended, so that cassettes saved before
+        remain valid until :meth:`rewrite_sidecar` is called, and a body
+        appended once by this store is not appended again.
+        """
+        data = _body_bytes(body)
+        if not data:
+            return body
+        digest = hashlib.sha256(data).digest()
+        with self._sidecar_lock:
+            offset = self._appended.get(digest)
+            if offset is None:
+                with self._open_sidecar() as fd:
+                    offset = fd.seek(0, os.SEEK_END)
+                    fd.write(data)
+                self._appended[digest] = offset
+        return {'encoding': body['encoding'], 'offset': offset,
+                'length': len(data)}
+
+    def record(self, fileobj, threshold=None, sidecar=False):
+        """Store a body while it is read from ``fileobj``.
+
+        The body is read and hashed a chunk at a time so that it never has
+        to be held in memory as a whole. Bodies larger than ``threshold``
+        bytes are stored as blobs, the others are appended to the sidecar
+        if ``sidecar`` is true. Without a threshold every body goes to the
+        sidecar.
+
+        :returns: the reference to the stored body, e.g.,
+            ``{'sha256': '...'}``, and ``None``, or ``None`` and the body if
+            it is to be kept in the cassette
+        """
+        if threshold is None:
+            return self._record_in_sidecar(fileobj)
+        reference, data = self._record_as_blob(fileobj, threshold)
+        if reference is None and sidecar and data:
+            stored = self.sidecar_body({'encoding': None, 'bytes': data})
+            reference = {'offset': stored['offset'],
+                         'length': stored['length']}
+            data = None
+        return reference, data
+
+    def rewrite_sidecar(self, bodies):
+        """Rewrite the sidecar so that it only holds ``bodies``.
+
+        Bodies appended while the cassette was recorded before, which it no
+        longer refers to, are dropped and bodies appended more than once are
+        kept once. The new sidecar replaces the old one atomically, so the
+        cassette referring to it must be saved right after.
+
+        :param bodies: all the bodies of the cassette
+        :returns: the new offsets of the bodies in the sidecar by their old
+            ``(offset, length)``, or ``None`` if the sidecar is unchanged
+        """
+        ranges = list(dict.fromkeys(
+            (body['offset'], body['length']) for body in bodies
+            if isinstance(body, dict) and 'offset' in body
+        ))
+
+        with self._sidecar_lock:
+            size = self._sidecar_size()
+            if size is None:
+                return None
+            if not ranges:
+                if not os.path.exists(self.sidecar_path):
+                    # Members of the archive are left alone
+                    return None
+                os.unlink(self.sidecar_path)
+                self._appended = {}
+                return {}
+
+            temporary_path = '{0}.{1}.tmp'.format(self.sidecar_path,
+                                                  os.urandom(4).hex())
+            moved, appended = {}, {}
+            directory = os.path.dirname(self.sidecar_path)
+            if directory:
+                # The cassette may be recorded into an archive's overlay
+                os.makedirs(directory, exist_ok=True)
+            try:
+                with open(temporary_path, 'wb') as dst:
+                    for offset, length in ranges:
+                        position = dst.tell()
+                        digest = hashlib.sha256()
+                        with self.open({'offset': offset,
+                                        'length': length}) as src:
+                            for chunk in _chunks(src):
+                                digest.update(chunk)
+                                dst.write(chunk)
+                        digest = digest.digest()
+                        if digest in appended:
+                            dst.seek(position)
+                            dst.truncate()
+                        else:
+                            appended[digest] = position
+                        moved[(offset, length)] = appended[digest]
+                    unchanged = dst.tell() == size and all(
+                        new == old[0] for old, new in moved.items())
+                if unchanged:
+                    os.unlink(temporary_path)
+                    return None
+                self.close()
+                os.replace(temporary_path, self.sidecar_path)
+            except BaseException:
+                if os.path.exists(temporary_path):
+                    os.unlink(temporary_path)
+                raise
+            self._appended = appended
+        return moved
+
+    def _sidecar_size(self):
+        try:
+            return os.stat(self.sidecar_path).st_size
+        except FileNotFoundError:
+            pass
+        member = self._sidecar_member()
+        if member is None:
+            return None
+        return archive.open_archive(self.archive_path).getinfo(
+            member).file_size
+
+    def _record_in_sidecar(self, fileobj):
+        digest = hashlib.sha256()
+        # The body is read from the network before the lock is taken, so that
+        # slow responses do not hold up other threads recording theirs
+        with tempfile.SpooledTemporaryFile(CHUNK_SIZE) as spool:
+            for chunk in _chunks(fileobj):
+                digest.update(chunk)
+                spool.write(chunk)
+            length = spool.tell()
+            if not length:
+                return None, b''
+            digest = digest.digest()
+            spool.seek(0)
+            with self._sidecar_lock:
+                offset = self._appended.get(digest)
+                if offset is None:
+                    with self._open_sidecar() as fd:
+                        offset = fd.seek(0, os.SEEK_END)
+                        shutil.copyfileobj(spool, fd, CHUNK_SIZE)
+                    self._appended[digest] = offset
+        return {'offset': offset, 'length': length}, None
+
+    def _record_as_blob(self, fileobj, threshold):
+        digest = hashlib.sha256()
+        head = bytearray()
+        chunks = _chunks(fileobj)
+        for chunk in chunks:
+            digest.update(chunk)
+            head += chunk
+            if len(head) > threshold:
+                break
+        else:
+            # The whole body was read without going over the threshold
+            return None, bytes(head)
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = os.path.join(
+            self.directory, '{0}.tmp'.format(os.urandom(8).hex())
+        )
+        try:
+            with open(temporary_path, 'wb') as fd:
+                fd.write(head)
+                del head
+                for chunk in chunks:
+                    digest.update(chunk)
+                    fd.write(chunk)
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path) or self._member(digest) is not None:
+                os.unlink(temporary_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return {'sha256': digest}, None
+
+    def _open_sidecar(self):
+        """Open the sidecar for appending, creating it if necessary."""
+        if (not os.path.exists(self.sidecar_path) and
+                self._sidecar_member() is not None):
+            # Keep the bodies that cassettes in the archive refer to
+            with archive.open_archive(self.archive_path).open(
+                    self._sidecar_member()) as src:
+                with open(self.sidecar_path, 'xb') as dst:
+                    shutil.copyfileobj(src, dst)
+        return open(self.sidecar_path, 'ab')
+
+    def _map_sidecar(self, offset, length):
+        """Return a view of a body in the sidecar's memory map.
+
+        The sidecar stays mapped while the same file is large enough, since
+        bodies are only ever appended to it.
+        """
+        if not length:
+            return memoryview(b'')
+        with self._map_lock:
+            try:
+                stat = os.stat(self.sidecar_path)
+            except FileNotFoundError:
+                return None
+            cached = self._sidecar_map
+            if cached is None or cached[0] != (stat.st_dev, stat.st_ino) or (
+                    len(cached[2]) < offset + length):
+                self._release_map()
+                mapped = _mapped(self.sidecar_path, offset + length)
+                if mapped is None:
+                    return None
+                cached = self._sidecar_map = ((stat.st_dev, stat.st_ino),
+                                              mapped, memoryview(mapped))
+            return cached[2][offset:offset + length]
+
+    def _release_map(self):
+        cached, self._sidecar_map = self._sidecar_map, None
+        if cached is None:
+            return
+        cached[2].release()
+        try:
+            cached[1].close()
+        except BufferError:
+            # Still read by responses, it is unmapped once they are gone
+            pass
+
+    def _open_blob(self, digest):
+        # Blobs are shared by many cassettes but each is read rarely, so
+        # they are unmapped as soon as the body is read
+        mapped = _mapped(self.path(digest))
+        if mapped is not None:
+            return BodyReader(memoryview(mapped))
+        member = self._member(digest)
+        if member is None:
+            raise BetamaxError(
+                'The body {0} is missing from the blob store in '
+                '{1!r}'.format(digest, self.directory)
+                )
+        return io.BytesIO(archive.open_archive(self.archive_path).read(member))
+
+    def _member(self, digest):
+        if self.archive_path is None:
+            return None
+        member = '/'.join((BLOBS_DIRECTORY, digest[:2], digest))
+        if archive.has_member(self.archive_path, member):
+            return member
+        return None
+
+    def _sidecar_member(self):
+        if self.archive_path is None:
+            return None
+        member = archive.member_name(self.archive_path, self.sidecar_path)
+        if archive.has_member(self.archive_path, member):
+            return member
+        return None
+
+
+def _mapped(path, size=0):
+    """Map the file at ``path`` into memory.
+
+    :param int size: how many bytes the file must at least have
+    :returns: a :class:`mmap.mmap`, or ``b''`` for an empty file, or ``None``
+        if the file does not exist or is too small
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if stat.st_size < size:
+        return None
+    if stat.st_size == 0:
+        # Empty files cannot be mapped
+        return b''
+    with open(path, 'rb') as fd:
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _chunks(fileobj):
+    return iter(lambda: fileobj.read(CHUNK_SIZE), b'')
+
+
+def relocated(body, moved):
+    """Return ``body`` at its new offset after the sidecar was rewritten.
+
+    :param dict moved: what :meth:`BlobStore.rewrite_sidecar` returned
+    """
+    if isinstance(body, dict) and 'offset' in body:
+        return dict(body, offset=moved[(body['offset'], body['length'])])
+    return body
+
+
+def _body_bytes(body):
+    """Return the contents of a body which is saved in the cassette."""
+    if not isinstance(body, dict):
+        return None
+    if 'base64_string' in body:
+        return base64.b64decode(body['base64_string'])
+    if 'bytes' in body:
+        return bytes(body['bytes'])
+    if 'string' in body:
+        try:
+            return body['string'].encode(body['encoding'] or 'utf-8')
+        except (UnicodeError, LookupError):
+            return None
+    return None
+
+
+def collect_garbage(cassette_library_dir):
+    """Remove the blobs which no cassette in the library refers to.
+
+    Every file in the library is searched for the digests of the blobs, after
+    decompressing compressed cassettes, which raises an exception rather
+    than removing anything if one of them is corrupt. Do not run this while
+    cassettes are being recorded since their blobs are stored before the
+    cassettes are.
+
+    .. code-block:: python
+
+        from betamax.serializers.blobs import collect_garbage
+
+        collect_garbage('tests/cassettes')
+
+    :param str cassette_library_dir: the cassette library's directory or
+        zip archive. Blobs which are in an archive are never removed.
+    :returns: the digests of the blobs that were removed
+    """
+    directory = cassette_library_dir
+    referenced = set()
+    if archive.is_archive(cassette_library_dir):
+        directory = archive.overlay_directory(cassette_library_dir)
+        zipped = archive.open_archive(cassette_library_dir)
+        for name in zipped.namelist():
+            if not name.startswith(BLOBS_DIRECTORY + '/'):
+                referenced.update(_references(name, zipped.read(name),
+                                              directory))
+
+    blobs = os.path.join(directory, BLOBS_DIRECTORY)
+    for path, dirnames, filenames in os.walk(directory):
+        if path == directory and BLOBS_DIRECTORY in dirnames:
+            dirnames.remove(BLOBS_DIRECTORY)
+        for filename in filenames:
+            if filename.endswith('.bodies'):
+                # Sidecars only hold bodies
+                continue
+            with open(os.path.join(path, filename), 'rb') as fd:
+                referenced.update(_references(filename, fd.read(),
+                                              directory))
+
+    removed = []
+    for path, _, filenames in os.walk(blobs):
+        for digest in filenames:
+            if digest.encode() not in referenced:
+                os.unlink(os.path.join(path, digest))
+                removed.append(digest)
+    return sorted(removed)
+
+
+class _Library(object):
+    # What the compressors need to know about the serializer
+    compression_level = None
+
+    def __init__(self, cassette_library_dir):
+        self.cassette_library_dir = cassette_library_dir
+
+
+def _references(filename, data, cassette_library_dir):
+    extension = os.path.splitext(filename)[1].lstrip('.')
+    for (compressed_extension, _, reader) in compressors.values():
+        if extension == compressed_extension:
+            # Errors are not caught since the references in a cassette
+            # which cannot be read are unknown
+            with reader(io.BytesIO(data),
+                        _Library(cassette_library_dir)) as fd:
+                data = fd.read()
+            break
+    return set(_REFERENCE.findall(data))
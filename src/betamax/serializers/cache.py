@@ -0,0 +1,171 @@
+import collections
+import hashlib
+import os
+import pickle
+import threading
+
+#: Bump this whenever the layout of cache entries changes
+CACHE_VERSION = 1
+
+# Errors raised when unpickling an entry that is corrupt or was written by
+# an incompatible version of Betamax or Python
+_LOAD_ERRORS = (EOFError, OSError, ValueError, TypeError, AttributeError,
+                ImportError, IndexError, pickle.UnpicklingError)
+
+
+class CassetteCache(object):
+    """Store the deserialized data of cassettes as pickles in a directory.
+
+    An entry is used instead of deserializing the cassette as long as the
+    cassette file has the same size and either the same modification time or
+    the same contents as when the entry was written. The contents are
+    compared by their SHA-256 digest so that entries survive fresh
+    checkouts, which reset modification times.
+
+    Entries hold the cassette data as it is stored in the file, i.e., before
+    placeholders are substituted, so no sensitive values are written to the
+    cache directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entry_path(self, cassette_path):
+        """Return the path of the entry for a cassette."""
+        key = hashlib.sha1(
+            os.path.abspath(cassette_path).encode('utf-8', 'surrogatepass')
+        ).hexdigest()
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, cassette_path, serializer_name):
+        """Return the cached data for a cassette or ``None`` if it is stale.
+
+        :param str cassette_path: path of the cassette file
+        :param str serializer_name: name of the serializer for the cassette
+        """
+        try:
+            stat = os.stat(cassette_path)
+            with open(self.entry_path(cassette_path), 'rb') as fd:
+                entry = pickle.load(fd)
+            (version, path, name, mtime, size, digest, data) = entry
+        except _LOAD_ERRORS:
+            return None
+
+        if (version != CACHE_VERSION or name != serializer_name or
+                path != os.path.abspath(cassette_path) or
+                size != stat.st_size):
+            return None
+        if mtime != stat.st_mtime_ns:
+            if digest != _digest(cassette_path):
+                return None
+            # Remember the new modification time to skip hashing next time
+            self.store(cassette_path, serializer_name, data, digest)
+        return data
+
+    def store(self, cassette_path, serializer_name, data, digest=None):
+        """Write the entry for a cassette.
+
+        Data which cannot be pickled is silently not cached.
+        """
+        stat = os.stat(cassette_path)
+        if digest is None:
+            digest = _digest(cassette_path)
+        entry = (CACHE_VERSION, os.path.abspath(cassette_path),
+                 serializer_name, stat.st_mtime_ns, stat.st_size, digest,
+                 data)
+        try:
+            pickled = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        except (TypeError, ValueError, pickle.PicklingError):
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        entry_path = self.entry_path(cassette_path)
+        temporary_path = '{0}.{1}.tmp'.format(entry_path,
+                                              os.urandom(4).hex())
+        try:
+            with open(temporary_path, 'wb') as fd:
+                fd.write(pickled)
+            os.replace(temporary_path, entry_path)
+        except OSError:
+            # The cache is only an optimization
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+
+class MemoryCache(object):
+    """Keep the deserialized data of recently used cassettes in memory.
+
+    Entries are looked up by the cassette's path and a key describing the
+    file, e.g., its modification time and size, and the least recently used
+    ones are evicted once there are more than ``max_entries`` of them or the
+    cassette files they were read from add up to more than ``max_bytes``.
+
+    The cached data is shared by everything that loads the cassette and must
+    not be modified.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=64 * 1024 * 1024):
+        #: Maximum number of cassettes to keep, ``0`` disables the cache
+        self.max_entries = max_entries
+        #: Maximum total size of the cassette files whose data is kept
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, key):
+        """Return the data cached for ``path`` under ``key`` or ``None``."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != key:
+                return None
+            self._entries.move_to_end(path)
+            return entry[2]
+
+    def put(self, path, key, data, size):
+        """Cache the data of the cassette at ``path``.
+
+        :param int size: the size of the cassette file
+        """
+        with self._lock:
+            self._discard(path)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            self._entries[path] = (key, size, data)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def discard(self, path):
+        """Forget the data cached for ``path``."""
+        with self._lock:
+            self._discard(path)
+
+    def clear(self):
+        """Forget all cached data."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+#: Cache of the cassettes deserialized by this process
+memory_cache = MemoryCache()
+
+
+def _digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.digest()
@@ -0,0 +1,355 @@
+from .base import BaseSerializer
+
+from betamax.exceptions import BetamaxError
+
+import bz2
+import collections
+import copy
+import gzip
+import io
+import lzma
+import os
+import re
+import struct
+import zlib
+
+#: Size of the chunks read from compressed cassettes
+CHUNK_SIZE = 64 * 1024
+
+#: Name of the file in the cassette library holding the zlib dictionary used
+#: by the ``zdict`` compressor
+DICTIONARY_NAME = 'betamax.zdict'
+
+#: Default size of trained dictionaries. zlib never looks further back than
+#: 32KiB so larger dictionaries are of no use.
+DICTIONARY_SIZE = 32 * 1024
+
+
+def _gzip_writer(fileobj, serializer):
+    # A fixed mtime keeps the output identical for identical cassettes
+    level = serializer.compression_level
+    return gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0,
+                         compresslevel=9 if level is None else level)
+
+
+def _gzip_reader(fileobj, serializer):
+    return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+def _bz2_writer(fileobj, serializer):
+    level = serializer.compression_level
+    # bzip2 cannot store data uncompressed, 1 is its fastest level
+    return bz2.BZ2File(fileobj, 'wb',
+                       compresslevel=9 if level is None else max(level, 1))
+
+
+def _bz2_reader(fileobj, serializer):
+    return bz2.BZ2File(fileobj, 'rb')
+
+
+def _xz_writer(fileobj, serializer):
+    return lzma.LZMAFile(fileobj, 'wb', preset=serializer.compression_level)
+
+
+def _xz_reader(fileobj, serializer):
+    return lzma.LZMAFile(fileobj, 'rb')
+
+
+def _zlib_writer(fileobj, serializer):
+    return io.BufferedWriter(
+        ZlibWriter(fileobj, serializer.compression_level), CHUNK_SIZE
+    )
+
+
+def _zlib_reader(fileobj, serializer):
+    return io.BufferedReader(ZlibReader(fileobj), CHUNK_SIZE)
+
+
+def _zdict_writer(fileobj, serializer):
+    zdict = load_dictionary(serializer.cassette_library_dir)
+    return io.BufferedWriter(
+        ZlibWriter(fileobj, serializer.compression_level, zdict), CHUNK_SIZE
+    )
+
+
+def _zdict_reader(fileobj, serializer):
+    start = fileobj.tell()
+    header = fileobj.read(6)
+    fileobj.seek(start)
+    zdict = None
+    if (len(header) == 6 and (header[0] << 8 | header[1]) % 31 == 0 and
+            header[1] & 0x20):
+        # The stream was compressed with the dictionary whose Adler-32
+        # checksum follows the two header bytes
+        zdict = load_dictionary(serializer.cassette_library_dir)
+        expected = struct.unpack('>I', header[2:])[0]
+        if zdict is None or zlib.adler32(zdict) != expected:
+            raise BetamaxError(
+                'The cassette was compressed with a dictionary other than '
+                'the one in {0!r}'.format(serializer.cassette_library_dir)
+                )
+    return io.BufferedReader(ZlibReader(fileobj, zdict), CHUNK_SIZE)
+
+
+#: Map of the suffixes accepted after ``+`` in ``serialize_with`` to the
+#: cassette file extension and the functions wrapping a file object for
+#: writing and for reading
+compressors = {
+    'gz': ('gz', _gzip_writer, _gzip_reader),
+    'bz2': ('bz2', _bz2_writer, _bz2_reader),
+    'xz': ('xz', _xz_writer, _xz_reader),
+    'zlib': ('zlib', _zlib_writer, _zlib_reader),
+    'zdict': ('zz', _zdict_writer, _zdict_reader),
+}
+
+#: Exceptions raised by the decompressors for corrupt or truncated data
+DECOMPRESSION_ERRORS = (EOFError, OSError, lzma.LZMAError, zlib.error)
+
+
+class CompressedSerializer(BaseSerializer):
+    """Wrap another serializer and compress what it writes.
+
+    Instances are created by the serializer registry for names such as
+    ``'json+gz'``, i.e., the name of a registered serializer followed by
+    ``+`` and one of the keys of :data:`compressors`. Cassettes are
+    compressed and decompressed as they are written and read.
+    """
+
+    stored_as_binary = True
+
+    def __init__(self, serializer, compression, compression_level=None):
+        self.serializer = serializer
+        self.compression = compression
+        #: Compression level, or ``None`` for the compressor's default
+        self.compression_level = compression_level
+        #: Directory of the cassette library, where the ``zdict``
+        #: compressor finds its dictionary
+        self.cassette_library_dir = None
+        self.name = '{0}+{1}'.format(serializer.name, compression)
+        super(CompressedSerializer, self).__init__()
+
+    def for_cassette(self, cassette_library_dir, compression_level=None):
+        """Return a copy of this serializer to use for one cassette."""
+        serializer = copy.copy(self)
+        serializer.cassette_library_dir = cassette_library_dir
+        if compression_level is not None:
+            serializer.compression_level = compression_level
+        return serializer
+
+    def generate_cassette_name(self, cassette_library_dir, cassette_name):
+        extension = compressors[self.compression][0]
+        return '{0}.{1}'.format(
+            self.serializer.generate_cassette_name(cassette_library_dir,
+                                                   cassette_name),
+            extension,
+        )
+
+    def serialize(self, cassette_data):
+        fileobj = io.BytesIO()
+        self.dump(cassette_data, fileobj)
+        return fileobj.getvalue()
+
+    def deserialize(self, cassette_data):
+        return self.load(io.BytesIO(cassette_data))
+
+    def dump(self, cassette_data, fileobj):
+        writer = compressors[self.compression][1](fileobj, self)
+        with writer:
+            if self.serializer.stored_as_binary:
+                self.serializer.dump(cassette_data, writer)
+            else:
+                text = io.TextIOWrapper(writer, encoding='utf-8',
+                                        newline='')
+                self.serializer.dump(cassette_data, text)
+                text.flush()
+                text.detach()
+
+    def load(self, fileobj):
+        reader = compressors[self.compression][2](fileobj, self)
+        try:
+            with reader:
+                if self.serializer.stored_as_binary:
+                    return self.serializer.load(reader)
+                text = io.TextIOWrapper(reader, encoding='utf-8',
+                                        newline='')
+                data = self.serializer.load(text)
+                text.detach()
+                return data
+        except DECOMPRESSION_ERRORS:
+            # Treat corrupt cassettes like unparsable ones
+            return {}
+
+
+class ZlibWriter(io.RawIOBase):
+    """Compress everything written into a zlib stream in ``fileobj``."""
+
+    def __init__(self, fileobj, level=None, zdict=None):
+        self._fileobj = fileobj
+        kwargs = {} if zdict is None else {'zdict': zdict}
+        self._compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, zlib.MAX_WBITS, **kwargs
+        )
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._fileobj.write(self._compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._fileobj.write(self._compressor.flush())
+        super(ZlibWriter, self).close()
+
+
+class ZlibReader(io.RawIOBase):
+    """Decompress the zlib stream in ``fileobj`` as it is read."""
+
+    def __init__(self, fileobj, zdict=None):
+        self._fileobj = fileobj
+        kwargs = {} if zdict is None else {'zdict': zdict}
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS, **kwargs)
+        self._started = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        decompressor = self._decompressor
+        while not decompressor.eof:
+            data = (decompressor.unconsumed_tail or
+                    self._fileobj.read(CHUNK_SIZE))
+            if not data:
+                if not self._started:
+                    # An empty file is an empty cassette
+                    return 0
+                raise EOFError('Compressed cassette ended before the '
+                               'end-of-stream marker was reached')
+            self._started = True
+            decompressed = decompressor.decompress(data, len(buffer))
+            if decompressed:
+                buffer[:len(decompressed)] = decompressed
+                return len(decompressed)
+        return 0
+
+
+_dictionaries = {}
+
+
+def load_dictionary(cassette_library_dir):
+    """Return the ``zdict`` dictionary of a cassette library.
+
+    :param str cassette_library_dir: the cassette library's directory
+    :returns: the dictionary as bytes or ``None`` if the library has none
+    """
+    if cassette_library_dir is None:
+        return None
+    path = os.path.join(cassette_library_dir, DICTIONARY_NAME)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _dictionaries.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, 'rb') as fd:
+            cached = _dictionaries[path] = (key, fd.read())
+    return cached[1]
+
+
+# Fragments of serialized cassettes, e.g., ``"Content-Type": [`` or
+# ``"application/json"], `` for JSON
+_FRAGMENT = re.compile(rb'[^,:{}\[\]\n]*[,:{}\[\]\n]+\s*')
+
+
+def train_dictionary(cassette_library_dir, serialize_with='json',
+                     size=DICTIONARY_SIZE):
+    """Train the dictionary of a cassette library for the ``zdict`` mode.
+
+    The dictionary is built from the fragments that occur in the most
+    cassettes serialized with ``serialize_with``, whether they are already
+    compressed with ``zdict`` or not. It is stored in the library's directory
+    as ``betamax.zdict``. Cassettes compressed with a previous dictionary are
+    recompressed with the new one so that they can still be read.
+
+    .. code-block:: python
+
+        from betamax.serializers.compressed import train_dictionary
+
+        train_dictionary('tests/cassettes')
+
+    :param str cassette_library_dir: the cassette library's directory
+    :param str serialize_with: name of the serializer whose cassettes to
+        train on
+    :param int size: maximum size of the dictionary in bytes
+    :returns: the dictionary
+    """
+    from . import serializer_registry
+
+    serializer = serializer_registry[serialize_with]
+    extension = os.path.splitext(
+        serializer.generate_cassette_name('', 'cassette'))[1]
+    compressed_extension = '{0}.{1}'.format(extension, compressors['zdict'][0])
+    previous = load_dictionary(cassette_library_dir)
+
+    compressed_paths = []
+    counts = collections.Counter()
+    for directory, _, filenames in os.walk(cassette_library_dir):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename.endswith(compressed_extension):
+                compressed_paths.append(path)
+                with open(path, 'rb') as fd:
+                    sample = _decompress(fd.read(), previous)
+            elif filename.endswith(extension):
+                with open(path, 'rb') as fd:
+                    sample = fd.read()
+            else:
+                continue
+            counts.update(set(_FRAGMENT.findall(sample)))
+
+    # Prefer fragments which are common and long. Only fragments shared by
+    # several cassettes are worth it unless there is just one cassette.
+    minimum = 2 if max(counts.values(), default=0) > 1 else 1
+    fragments = sorted(
+        (f for f, n in counts.items() if n >= minimum and len(f) > 3),
+        key=lambda f: (counts[f] * len(f), f), reverse=True,
+    )
+    selected = []
+    total = 0
+    for fragment in fragments:
+        if total + len(fragment) <= size:
+            selected.append(fragment)
+            total += len(fragment)
+    # zlib finds matches closer to the end of the dictionary more cheaply,
+    # so the most valuable fragments go last
+    dictionary = b''.join(reversed(selected))
+
+    for path in compressed_paths:
+        with open(path, 'rb') as fd:
+            data = _decompress(fd.read(), previous)
+        if not data:
+            continue
+        compressor = zlib.compressobj(zdict=dictionary)
+        _replace(path, compressor.compress(data) + compressor.flush())
+    _replace(os.path.join(cassette_library_dir, DICTIONARY_NAME), dictionary)
+    return dictionary
+
+
+def _decompress(data, zdict):
+    if not data:
+        return data
+    if zdict is None:
+        return zlib.decompress(data)
+    decompressor = zlib.decompressobj(zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _replace(path, data):
+    temporary_path = '{0}.{1}.tmp'.format(path, os.urandom(4).hex())
+    with open(temporary_path, 'wb') as fd:
+        fd.write(data)
+    os.replace(temporary_path, path)
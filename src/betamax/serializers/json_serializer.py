@@ -1,8 +1,70 @@
 from .base import BaseSerializer
 
+import collections
+import functools
 import json
 import os
 
+#: A JSON library: its name, the functions to encode and decode JSON, the
+#: separators it writes and whether it encodes to bytes rather than text
+Backend = collections.namedtuple(
+    'Backend', 'name dumps loads separators binary'
+)
+
+
+def _json_backend():
+    return Backend('json', json.dumps, json.loads, (', ', ': '), False)
+
+
+def _orjson_backend():
+    import orjson
+    return Backend('orjson', orjson.dumps, orjson.loads, (',', ':'), True)
+
+
+def _ujson_backend():
+    import ujson
+    dumps = functools.partial(ujson.dumps, escape_forward_slashes=False)
+    return Backend('ujson', dumps, ujson.loads, (',', ':'), False)
+
+
+def _simdjson_backend():
+    # simdjson only parses JSON
+    import simdjson
+    return Backend('simdjson', json.dumps, simdjson.loads, (', ', ': '),
+                   False)
+
+
+#: The supported JSON libraries in the order they are preferred in
+backends = collections.OrderedDict([
+    ('orjson', _orjson_backend),
+    ('ujson', _ujson_backend),
+    ('simdjson', _simdjson_backend),
+    ('json', _json_backend),
+])
+
+
+def load_backend(name=None):
+    """Return the named JSON backend or the default one.
+
+    The default backend writes cassettes with the standard library, so that
+    they do not depend on what is installed, and reads them with the first
+    library of :data:`backends` which is installed.
+
+    :param str name: one of the keys of :data:`backends` or ``None``
+    :raises ImportError: if the named backend is not installed
+    """
+    if name is not None:
+        if name not in backends:
+            raise ValueError('Unknown JSON backend {0!r}'.format(name))
+        return backends[name]()
+
+    for factory in backends.values():
+        try:
+            fastest = factory()
+        except ImportError:
+            continue
+        return _json_backend()._replace(loads=fastest.loads)
+
 
 class JSONSerializer(BaseSerializer):
     # Serializes and deserializes a cassette to JSON
@@ -14,13 +76,89 @@ class JSONSerializer(BaseSerializer):
         return os.path.join(cassette_library_dir,
                             '{0}.{1}'.format(cassette_name, 'json'))
 
+    def on_init(self):
+        self.use_backend()
+
+    def use_backend(self, name=None):
+        """Select the JSON library used to (de)serialize cassettes.
+
+        By default cassettes are written by the standard library and read by
+        the fastest installed library. The same library always produces the
+        same file for the same cassette, but different libraries format
+        cassettes differently.
+
+        :param str name: ``'orjson'``, ``'ujson'``, ``'simdjson'``,
+            ``'json'``, or ``None`` for the default
+        """
+        self.backend = load_backend(name)
+        # Subclasses which override the string API keep working with text
+        self.stored_as_binary = self.backend.binary and not (
+            self._overrides('serialize') or self._overrides('deserialize')
+        )
+
     def serialize(self, cassette_data):
-        return json.dumps(cassette_data)
+        return self._dumps(cassette_data)
+
+    def dump(self, cassette_data, fileobj):
+        if self._overrides('serialize'):
+            return super(JSONSerializer, self).dump(cassette_data, fileobj)
+
+        # Produces the same text as serialize but encodes and writes one
+        # interaction at a time
+        comma, colon = self._punctuation(*self.backend.separators)
+        opening, closing, start, end = self._punctuation('{', '}', '[', ']')
+        fileobj.write(opening)
+        for n, (key, value) in enumerate(cassette_data.items()):
+            if n:
+                fileobj.write(comma)
+            fileobj.write(self._dumps(key) + colon)
+            if key == 'http_interactions' and isinstance(value, list):
+                fileobj.write(start)
+                for m, interaction in enumerate(value):
+                    if m:
+                        fileobj.write(comma)
+                    fileobj.write(self._dumps(interaction))
+                fileobj.write(end)
+            else:
+                fileobj.write(self._dumps(value))
+        fileobj.write(closing)
 
     def deserialize(self, cassette_data):
         try:
-            deserialized_data = json.loads(cassette_data)
+            deserialized_data = self.backend.loads(cassette_data)
         except ValueError:
             deserialized_data = {}
+            if self.backend.loads is not json.loads and cassette_data:
+                # The standard library accepts some JSON other backends do
+                # not, e.g., escaped lone surrogates
+                try:
+                    deserialized_data = json.loads(cassette_data)
+                except ValueError:
+                    pass
 
         return deserialized_data
+
+    def _dumps(self, value):
+        try:
+            return self.backend.dumps(value)
+        except TypeError:
+            if self.backend.name == 'json':
+                raise
+            # Let the standard library handle what the backend cannot, e.g.,
+            # lone surrogates or integers larger than 64 bits
+            if not self.backend.binary:
+                return json.dumps(value, separators=self.backend.separators)
+            dumped = json.dumps(value, separators=self.backend.separators,
+                                ensure_ascii=False)
+            # Lone surrogates can only be in strings where their escaped
+            # form is what JSON expects
+            return dumped.encode('utf-8', 'backslashreplace')
+
+    def _overrides(self, method):
+        return getattr(type(self), method) is not getattr(JSONSerializer,
+                                                          method)
+
+    def _punctuation(self, *strings):
+        if self.backend.binary:
+            return tuple(s.encode('ascii') for s in strings)
+        return strings
@@ -0,0 +1,63 @@
+from .base import BaseSerializer
+
+import io
+import json
+import os
+
+
+class JSONLinesSerializer(BaseSerializer):
+    # Serializes and deserializes a cassette to JSON Lines: a header line with
+    # everything but the interactions followed by one line per interaction
+    name = 'jsonl'
+    stored_as_binary = False
+    appendable = True
+
+    @staticmethod
+    def generate_cassette_name(cassette_library_dir, cassette_name):
+        return os.path.join(cassette_library_dir,
+                            '{0}.{1}'.format(cassette_name, 'jsonl'))
+
+    def serialize(self, cassette_data):
+        fileobj = io.StringIO()
+        self.dump(cassette_data, fileobj)
+        return fileobj.getvalue()
+
+    def dump(self, cassette_data, fileobj):
+        header = dict((k, v) for (k, v) in cassette_data.items()
+                      if k != 'http_interactions')
+        fileobj.write(json.dumps(header) + '\n')
+        for interaction in cassette_data.get('http_interactions', []):
+            fileobj.write(self.serialize_interaction(interaction))
+
+    def serialize_interaction(self, interaction_data):
+        return json.dumps(interaction_data) + '\n'
+
+    def deserialize(self, cassette_data):
+        return self.load(io.StringIO(cassette_data))
+
+    def load(self, fileobj):
+        lines = read_lines(fileobj)
+        deserialized_data = next(lines, None)
+        if deserialized_data is None:
+            return {}
+        deserialized_data['http_interactions'] = list(lines)
+        return deserialized_data
+
+
+def read_lines(fileobj):
+    """Yield the JSON document on each line of ``fileobj``.
+
+    A last line without a newline which does not hold a whole document was
+    left by an append that was interrupted, and is skipped, as are blank
+    lines. Any other line which is not a JSON document raises a
+    :class:`ValueError`.
+    """
+    for number, line in enumerate(fileobj, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            if line.endswith('\n'):
+                raise ValueError('Line {0} is not a JSON document: {1}'.format(
+                    number, error))
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 from .base import BaseSerializer
+from .cache import memory_cache
+from .jsonl_serializer import read_lines
+from . import archive
 from betamax.exceptions import MissingDirectoryError
 
+import io
+import json
 import os
+import shutil
 
 
 class SerializerProxy(BaseSerializer):
@@ -22,21 +28,51 @@ class SerializerProxy(BaseSerializer):
 
     """
 
-    def __init__(self, serializer, cassette_path, allow_serialization=False):
+    def __init__(self, serializer, cassette_path, allow_serialization=False,
+                 cassette_name=None):
         self.proxied_serializer = serializer
         self.allow_serialization = allow_serialization
         self.cassette_path = cassette_path
+        #: Name of the cassette, used by serializers which store cassettes
+        #: themselves
+        self.cassette_name = cassette_name
+        #: Directory of the cassette library, the overlay directory if the
+        #: library is a zip archive
+        self.cassette_library_dir = None
+        #: Path of the zip archive the cassette library is packed in, if any.
+        #: ``cassette_path`` is then in the archive's overlay directory.
+        self.archive_path = None
+        #: :class:`~betamax.serializers.cache.CassetteCache` of deserialized
+        #: cassettes, if any
+        self.cache = None
 
     def _ensure_path_exists(self):
-        directory, _ = os.path.split(self.cassette_path)
+        if self.stores_cassettes:
+            directory = self.proxied_serializer.cassette_library_dir
+        else:
+            directory, _ = os.path.split(self.cassette_path)
+        if self.archive_path is not None:
+            # The overlay directory is created on demand and cassettes are
+            # copied out of the archive before they are modified
+            os.makedirs(directory, exist_ok=True)
+            if (not os.path.exists(self.cassette_path) and
+                    self._in_archive()):
+                self._extract()
         if not (directory == '' or os.path.isdir(directory)):
             raise MissingDirectoryError(
                 'Configured cassette directory \'{0}\' does not exist - try '
                 'creating it'.format(directory)
                 )
-        if not os.path.exists(self.cassette_path):
+        if not (self.stores_cassettes or os.path.exists(self.cassette_path)):
             open(self.cassette_path, 'w+').close()
 
+    def exists(self):
+        """Return whether the cassette has been written before."""
+        if self.stores_cassettes:
+            return self.proxied_serializer.cassette_stat(
+                self.cassette_name) is not None
+        return os.path.exists(self.cassette_path) or self._in_archive()
+
     def corrected_file_mode(self, base_mode):
         storing_binary_data = getattr(self.proxied_serializer,
                                       'stored_as_binary',
@@ -45,19 +81,52 @@ class SerializerProxy(BaseSerializer):
             return '{}b'.format(base_mode)
         return base_mode
 
+    @property
+    def appendable(self):
+        """Whether interactions can be appended to the cassette itself."""
+        return getattr(self.proxied_serializer, 'appendable', False)
+
+    @property
+    def stores_cassettes(self):
+        """Whether the serializer reads and writes the cassette itself.
+
+        Such serializers, e.g., the SQLite serializer, implement
+        ``cassette_stat``, ``read_cassette``, ``write_cassette`` and
+        ``append_interaction`` instead of working on a file of their own.
+        """
+        return getattr(self.proxied_serializer, 'stores_cassettes', False)
+
+    @property
+    def journal_path(self):
+        """Path of the journal that interactions are appended to."""
+        return '{0}.journal'.format(self.cassette_path)
+
     @classmethod
-    def find(cls, serialize_with, cassette_library_dir, cassette_name):
+    def find(cls, serialize_with, cassette_library_dir, cassette_name,
+             compression_level=None):
         from . import serializer_registry
         serializer = serializer_registry.get(serialize_with)
         if serializer is None:
             raise ValueError(
                 'No serializer registered for {0}'.format(serialize_with)
                 )
+        archive_path = None
+        if archive.is_archive(cassette_library_dir):
+            # Cassettes are read from the archive and written to its overlay
+            archive_path = cassette_library_dir
+            cassette_library_dir = archive.overlay_directory(archive_path)
+        for_cassette = getattr(serializer, 'for_cassette', None)
+        if for_cassette is not None:
+            serializer = for_cassette(cassette_library_dir, compression_level)
 
         cassette_path = cls.generate_cassette_name(
             serializer, cassette_library_dir, cassette_name
             )
-        return cls(serializer, cassette_path)
+        proxy = cls(serializer, cassette_path, cassette_name=cassette_name)
+        proxy.cassette_library_dir = cassette_library_dir
+        if not getattr(serializer, 'stores_cassettes', False):
+            proxy.archive_path = archive_path
+        return proxy
 
     @staticmethod
     def generate_cassette_name(serializer, cassette_library_dir,
@@ -71,18 +140,206 @@ class SerializerProxy(BaseSerializer):
             return
 
         self._ensure_path_exists()
-        mode = self.corrected_file_mode('w')
+        if self.stores_cassettes:
+            self.proxied_serializer.write_cassette(self.cassette_name,
+                                                   cassette_data)
+            memory_cache.discard(os.path.abspath(self.cassette_path))
+            return
+
+        mode = self.corrected_file_mode('x')
+
+        # Write to a file next to the cassette and move it into place so
+        # that the cassette is never left half written.
+        temporary_path = '{0}.{1}.tmp'.format(self.cassette_path,
+                                              os.urandom(4).hex())
+        try:
+            with open(temporary_path, mode) as fd:
+                self.proxied_serializer.dump(cassette_data, fd)
+            shutil.copymode(self.cassette_path, temporary_path)
+            os.replace(temporary_path, self.cassette_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        memory_cache.discard(os.path.abspath(self.cassette_path))
+        # The cassette now holds everything that was journaled
+        self.discard_journal()
+
+    def append(self, interaction_data, sync=False):
+        """Append a single interaction to the cassette's journal.
+
+        Appendable serializers write the interaction to the cassette itself.
+        Otherwise the journal holds one JSON document per line regardless of
+        the serializer used for the cassette.
+
+        :param dict interaction_data: the interaction to append
+        :param bool sync: whether to ``fsync`` the file after writing
+        """
+        if not self.allow_serialization:
+            return
+
+        self._ensure_path_exists()
+        if self.stores_cassettes:
+            self.proxied_serializer.append_interaction(
+                self.cassette_name, interaction_data, sync
+            )
+            return
+        if self.appendable:
+            path = self.cassette_path
+            _end_last_line(path)
+            serializer = self.proxied_serializer
+            line = serializer.serialize_interaction(interaction_data)
+            if os.path.getsize(path) == 0:
+                # Start a new cassette with its header
+                line = serializer.serialize({'http_interactions': []}) + line
+            mode = self.corrected_file_mode('a')
+        else:
+            path = self.journal_path
+            _end_last_line(path)
+            line = json.dumps(interaction_data) + '\n'
+            mode = 'a'
+
+        with open(path, mode) as fd:
+            fd.write(line)
+            fd.flush()
+            if sync:
+                os.fsync(fd.fileno())
 
-        with open(self.cassette_path, mode) as fd:
-            fd.write(self.proxied_serializer.serialize(cassette_data))
+    def read_journal(self):
+        """Return the interactions appended to the journal.
+
+        A last line that was only partially written, e.g., because the
+        process died while appending it, is ignored.
+        """
+        interactions = []
+        if self.stores_cassettes:
+            return interactions
+        try:
+            fd = open(self.journal_path, 'r')
+        except (IOError, OSError):
+            return interactions
+
+        with fd:
+            interactions.extend(read_lines(fd))
+        return interactions
+
+    def discard_journal(self):
+        """Remove the journal once its interactions are in the cassette."""
+        try:
+            os.unlink(self.journal_path)
+        except (IOError, OSError):
+            pass
 
     def deserialize(self):
+        if (self.archive_path is not None and
+                not os.path.exists(self.cassette_path)):
+            # Only cassettes recorded since the archive was packed are in
+            # the overlay directory
+            return self._deserialize_member()
         self._ensure_path_exists()
 
-        data = {}
-        mode = self.corrected_file_mode('r')
+        # The same cassette is often loaded many times by one process. Its
+        # data is shared between those loads and must not be modified.
+        name = self.proxied_serializer.name
+        path = os.path.abspath(self.cassette_path)
+        if self.stores_cassettes:
+            return self._deserialize_stored(path)
+
+        stat = os.stat(path)
+        key = (name, stat.st_mtime_ns, stat.st_size)
+        data = memory_cache.get(path, key)
+        if data is not None:
+            return data
+
+        if self.cache is not None:
+            data = self.cache.load(self.cassette_path, name)
 
-        with open(self.cassette_path, mode) as fd:
-            data = self.proxied_serializer.deserialize(fd.read())
+        if data is None:
+            mode = self.corrected_file_mode('r')
+            with open(self.cassette_path, mode) as fd:
+                data = self.proxied_serializer.load(fd)
 
+            if self.cache is not None:
+                self.cache.store(self.cassette_path, name, data)
+
+        memory_cache.put(path, key, data, stat.st_size)
         return data
+
+    def _in_archive(self):
+        return self.archive_path is not None and archive.has_member(
+            self.archive_path, self._member_name()
+        )
+
+    def _member_name(self):
+        return archive.member_name(self.archive_path, self.cassette_path)
+
+    def _extract(self):
+        zipped = archive.open_archive(self.archive_path)
+        with zipped.open(self._member_name()) as src:
+            with open(self.cassette_path, 'xb') as dst:
+                shutil.copyfileobj(src, dst)
+
+    def _deserialize_member(self):
+        if not self._in_archive():
+            return {}
+        name = self.proxied_serializer.name
+        member = self._member_name()
+        path = os.path.join(os.path.abspath(self.archive_path), member)
+        stat = os.stat(self.archive_path)
+        key = (name, stat.st_mtime_ns, stat.st_size)
+        data = memory_cache.get(path, key)
+        if data is not None:
+            return data
+
+        zipped = archive.open_archive(self.archive_path)
+        with zipped.open(member) as fd:
+            if self.proxied_serializer.stored_as_binary:
+                data = self.proxied_serializer.load(fd)
+            else:
+                text = io.TextIOWrapper(fd, encoding='utf-8', newline='')
+                data = self.proxied_serializer.load(text)
+                text.detach()
+        memory_cache.put(path, key, data, zipped.getinfo(member).file_size)
+        return data
+
+    def _deserialize_stored(self, path):
+        serializer = self.proxied_serializer
+        stat = serializer.cassette_stat(self.cassette_name)
+        if stat is None:
+            return {}
+        key = (serializer.name,) + stat[0]
+        data = memory_cache.get(path, key)
+        if data is None:
+            data = serializer.read_cassette(self.cassette_name)
+            memory_cache.put(path, key, data, stat[1])
+        return data
+
+
+def _end_last_line(path):
+    # A last line without a newline is left by an append which was
+    # interrupted. It is ended if it holds a whole document and dropped
+    # otherwise, so that it is not mistaken for a corrupted line once other
+    # lines are appended after it.
+    try:
+        fd = open(path, 'r+b')
+    except (IOError, OSError):
+        return
+    with fd:
+        end = position = fd.seek(0, os.SEEK_END)
+        while position:
+            size = min(position, io.DEFAULT_BUFFER_SIZE)
+            fd.seek(position - size)
+            newline = fd.read(size).rfind(b'\n')
+            if newline != -1:
+                position += newline + 1 - size
+                break
+            position -= size
+        if position == end:
+            return
+        fd.seek(position)
+        try:
+            json.loads(fd.read().decode('utf-8'))
+        except ValueError:
+            fd.truncate(position)
+        else:
+            fd.write(b'\n')
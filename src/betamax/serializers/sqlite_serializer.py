@@ -0,0 +1,258 @@
+from .base import BaseSerializer
+
+from contextlib import closing
+import base64
+import copy
+import json
+import os
+import sqlite3
+
+#: Name of the database holding the cassettes of a cassette library
+DATABASE_NAME = 'cassettes.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cassettes (
+    name TEXT PRIMARY KEY,
+    recorded_with TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    cassette TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    method TEXT,
+    uri TEXT,
+    recorded_at TEXT,
+    request TEXT NOT NULL,
+    request_body BLOB,
+    response TEXT NOT NULL,
+    response_body BLOB,
+    PRIMARY KEY (cassette, position)
+);
+DROP INDEX IF EXISTS interactions_by_key;
+'''
+
+_INSERT = '''
+INSERT INTO interactions (cassette, position, method, uri, recorded_at,
+                          request, request_body, response, response_body)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class SQLiteSerializer(BaseSerializer):
+    """Store all the cassettes of a cassette library in one SQLite database.
+
+    The database is ``cassettes.sqlite3`` in the cassette library directory.
+    Every interaction is a row keyed by the name of its cassette and its
+    position in it, with the bodies stored as blobs. Loading a cassette only
+    reads its own rows and recording appends rows rather than rewriting the
+    cassette. Requests are matched by the cassette in memory, so the method
+    and URI columns are only there to make the database easy to query.
+
+    Unlike other serializers this one reads and writes the cassettes
+    itself, so it cannot be combined with a compressor. Bodies which would
+    be base64 encoded by the JSON serializer are handed back as bytes under
+    the ``'bytes'`` key of the body.
+    """
+
+    name = 'sqlite'
+    stored_as_binary = True
+    appendable = True
+    stores_cassettes = True
+
+    def on_init(self):
+        #: Directory of the cassette library whose database is used
+        self.cassette_library_dir = None
+
+    @staticmethod
+    def generate_cassette_name(cassette_library_dir, cassette_name):
+        # Cassettes are addressed like members of the database
+        return os.path.join(cassette_library_dir, DATABASE_NAME,
+                            cassette_name)
+
+    def for_cassette(self, cassette_library_dir, compression_level=None):
+        """Return a copy of this serializer to use for one cassette."""
+        serializer = copy.copy(self)
+        serializer.cassette_library_dir = cassette_library_dir
+        return serializer
+
+    @property
+    def database(self):
+        """Path of the database."""
+        return os.path.join(self.cassette_library_dir or '', DATABASE_NAME)
+
+    def cassette_stat(self, cassette_name):
+        """Describe a cassette in the database.
+
+        :returns: ``None`` if there is no such cassette, otherwise a key
+            which changes whenever the cassette changes and the size of its
+            interactions in bytes
+        """
+        if not os.path.exists(self.database):
+            return None
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT version, size FROM cassettes WHERE name = ?',
+                (cassette_name,)
+            ).fetchone()
+            if row is None:
+                return None
+            # The database may also be replaced as a whole, e.g., by a
+            # checkout, which is told apart by its generation
+            (generation,) = connection.execute(
+                'PRAGMA user_version').fetchone()
+        return (generation, row[0]), row[1]
+
+    def read_cassette(self, cassette_name):
+        """Return the data of a cassette or ``{}`` if there is none."""
+        if not os.path.exists(self.database):
+            return {}
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT recorded_with FROM cassettes WHERE name = ?',
+                (cassette_name,)
+            ).fetchone()
+            if row is None:
+                return {}
+            rows = connection.execute(
+                'SELECT recorded_at, request, request_body, response, '
+                'response_body FROM interactions WHERE cassette = ? '
+                'ORDER BY position', (cassette_name,)
+            )
+            interactions = [_interaction(*r) for r in rows]
+        return {'http_interactions': interactions, 'recorded_with': row[0]}
+
+    def write_cassette(self, cassette_name, cassette_data):
+        """Replace all the interactions of a cassette."""
+        rows = [
+            _row(cassette_name, position, interaction)
+            for position, interaction in enumerate(
+                cassette_data.get('http_interactions', []))
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM interactions WHERE cassette = ?',
+                               (cassette_name,))
+            connection.executemany(_INSERT, rows)
+            connection.execute(
+                'INSERT OR IGNORE INTO cassettes (name) VALUES (?)',
+                (cassette_name,)
+            )
+            connection.execute(
+                'UPDATE cassettes SET recorded_with = ?, size = ?, '
+                'version = version + 1 WHERE name = ?',
+                (cassette_data.get('recorded_with'), _size(rows),
+                 cassette_name)
+            )
+
+    def append_interaction(self, cassette_name, interaction_data,
+                           sync=False):
+        """Add an interaction after the existing ones of a cassette.
+
+        SQLite makes every change durable when it is committed, so ``sync``
+        makes no difference.
+        """
+        from .. import __version__
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO cassettes (name, recorded_with) '
+                'VALUES (?, ?)',
+                (cassette_name, 'betamax/{0}'.format(__version__))
+            )
+            (position,) = connection.execute(
+                'SELECT COALESCE(MAX(position) + 1, 0) FROM interactions '
+                'WHERE cassette = ?', (cassette_name,)
+            ).fetchone()
+            row = _row(cassette_name, position, interaction_data)
+            connection.execute(_INSERT, row)
+            connection.execute(
+                'UPDATE cassettes SET size = size + ?, '
+                'version = version + 1 WHERE name = ?',
+                (_size([row]), cassette_name)
+            )
+
+    def _connect(self):
+        database = self.database
+        created = os.path.exists(database)
+        connection = sqlite3.connect(database, timeout=30)
+        path = os.path.abspath(database)
+        if not (created and path in _initialized):
+            _initialize(connection)
+            _initialized.add(path)
+        return connection
+
+
+# Databases whose schema was created or checked by this process
+_initialized = set()
+
+
+def _initialize(connection):
+    connection.executescript(SCHEMA)
+    (generation,) = connection.execute('PRAGMA user_version').fetchone()
+    if not generation:
+        # Tells this database apart from one which replaces it
+        connection.execute('PRAGMA user_version = {0}'.format(
+            int.from_bytes(os.urandom(4), 'big') >> 1 or 1))
+
+
+def _row(cassette_name, position, interaction):
+    request, request_body = _split_body(interaction['request'])
+    response, response_body = _split_body(interaction['response'])
+    return (cassette_name, position, request.get('method'),
+            request.get('uri'), interaction.get('recorded_at'),
+            json.dumps(request), request_body,
+            json.dumps(response), response_body)
+
+
+def _size(rows):
+    return sum(len(r[5]) + len(r[6]) + len(r[7]) + len(r[8]) for r in rows)
+
+
+def _interaction(recorded_at, request, request_body, response,
+                 response_body):
+    return {
+        'request': _join_body(json.loads(request), request_body),
+        'response': _join_body(json.loads(response), response_body),
+        'recorded_at': recorded_at,
+    }
+
+
+def _split_body(section):
+    """Take the body out of a request or response to store it as a blob.
+
+    The body left in the section records under which key the blob goes
+    back. Bodies which are plain strings are replaced with ``None``.
+    """
+    section = dict(section)
+    body = section['body']
+    if not isinstance(body, dict):
+        section['body'] = None
+        return section, body.encode('utf-8', 'surrogatepass')
+
+    body = dict(body)
+    if 'base64_string' in body:
+        blob = base64.b64decode(body.pop('base64_string'))
+        body['blob'] = 'bytes'
+    elif 'bytes' in body:
+        blob = bytes(body.pop('bytes'))
+        body['blob'] = 'bytes'
+    elif 'string' in body:
+        blob = body.pop('string').encode('utf-8', 'surrogatepass')
+        body['blob'] = 'string'
+    else:
+        # e.g., a reference to the blob store
+        blob = b''
+        body['blob'] = None
+    section['body'] = body
+    return section, blob
+
+
+def _join_body(section, blob):
+    body = section['body']
+    if body is None:
+        section['body'] = str(blob, 'utf-8', 'surrogatepass')
+    else:
+        key = body.pop('blob')
+        if key is not None:
+            body[key] = blob if key == 'bytes' else str(blob, 'utf-8',
+                                                        'surrogatepass')
+    return section
@@ -1,3 +1,4 @@
+from .exceptions import BetamaxError
 from .mock_response import MockHTTPResponse
 from datetime import datetime, timezone
 from requests.models import PreparedRequest, Response
@@ -12,9 +13,15 @@ except ImportError:
     from .headers import HTTPHeaderDict
 
 import base64
+import codecs
+import collections
+import functools
 import io
+import re
 import sys
 
+from urllib.parse import parse_qs, urlparse
+
 
 def coerce_content(content, encoding=None):
     if hasattr(content, 'decode'):
@@ -28,6 +35,117 @@ def body_io(string, encoding=None):
     return io.BytesIO(string)
 
 
+class BodyReader(io.RawIOBase):
+    """Read a body from a :class:`memoryview` without copying it first."""
+
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        data = self._view[self._position:self._position + size]
+        self._position += len(data)
+        return bytes(data)
+
+    def readall(self):
+        data = self._view[self._position:]
+        self._position = len(self._view)
+        return bytes(data)
+
+    def close(self):
+        super(BodyReader, self).close()
+        # Lets go of the memory map the body may be read from
+        self._view.release()
+
+
+class _DecodingReader(io.RawIOBase):
+    # Produce the bytes of a recorded body a chunk at a time as they are
+    # read, so that only about as much as is asked for is held in memory.
+
+    def __init__(self, source):
+        self._source = source
+        self._position = 0
+        self._pending = b''
+        self._finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._pending) < len(buffer) and not self._finished:
+            end = self._chunk_end(len(buffer) - len(self._pending))
+            end = min(end, len(self._source))
+            self._finished = end == len(self._source)
+            self._pending += self._decode(self._source[self._position:end])
+            self._position = end
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class Base64Reader(_DecodingReader):
+    """Decode a base64 encoded body as it is read."""
+
+    def _chunk_end(self, size):
+        # Whole groups of four characters encode three bytes
+        return self._position + -(-size // 3) * 4
+
+    def _decode(self, chunk):
+        return base64.b64decode(chunk)
+
+
+class TextReader(_DecodingReader):
+    """Encode a body recorded as text as it is read."""
+
+    def __init__(self, string, encoding=None):
+        super(TextReader, self).__init__(string)
+        self._encoder = codecs.getincrementalencoder(encoding or 'utf-8')()
+
+    def _chunk_end(self, size):
+        # Every character is encoded as at least one byte
+        return self._position + size
+
+    def _decode(self, chunk):
+        return self._encoder.encode(chunk, final=self._finished)
+
+
+ParsedURI = collections.namedtuple(
+    'ParsedURI', 'scheme netloc path fragment query'
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_uri(uri):
+    """Parse a URI into the parts the built-in matchers compare.
+
+    The query is parsed into a sorted tuple of ``(name, values)`` pairs so
+    that it is hashable and independent of the order of the parameters.
+    Results are cached since the same URI is usually compared by several
+    matchers in a row.
+    """
+    parsed = urlparse(uri)
+    query = parse_qs(
+        parsed.query or '',  # Protect against None
+        keep_blank_values=True,
+    )
+    return ParsedURI(
+        parsed.scheme, parsed.netloc, parsed.path, parsed.fragment,
+        tuple(sorted((k, tuple(v)) for k, v in query.items())),
+    )
+
+
 def from_list(value):
     if isinstance(value, list):
         return value[0]
@@ -51,7 +169,10 @@ def add_body(r, preserve_exact_body_bytes, body_dict):
     body = getattr(r, 'raw', getattr(r, 'body', None))
     if hasattr(body, 'read'):
         body = body.read()
+    _add_body_data(r, body, preserve_exact_body_bytes, body_dict)
+
 
+def _add_body_data(r, body, preserve_exact_body_bytes, body_dict):
     if not body:
         body = ''
 
@@ -79,16 +200,21 @@ def serialize_prepared_request(request, preserve_exact_body_bytes):
     }
 
 
-def deserialize_prepared_request(serialized):
-    p = PreparedRequest()
-    p._cookies = RequestsCookieJar()
-    body = serialized['body']
+def recorded_body(body):
+    """Return the recorded request body as a string or bytes."""
     if isinstance(body, dict):
+        if 'bytes' in body:
+            return bytes(body['bytes'])
         original_body = body.get('string')
-        p.body = original_body or base64.b64decode(
+        return original_body or base64.b64decode(
             body.get('base64_string', '').encode())
-    else:
-        p.body = body
+    return body
+
+
+def deserialize_prepared_request(serialized):
+    p = PreparedRequest()
+    p._cookies = RequestsCookieJar()
+    p.body = recorded_body(serialized['body'])
     h = [(k, from_list(v)) for k, v in serialized['headers'].items()]
     p.headers = CaseInsensitiveDict(h)
     p.method = serialized['method']
@@ -96,9 +222,24 @@ def deserialize_prepared_request(serialized):
     return p
 
 
-def serialize_response(response, preserve_exact_body_bytes):
+def serialize_response(response, preserve_exact_body_bytes,
+                       record_body=None):
+    """Serialize a response which was just received.
+
+    :param callable record_body: saves the body somewhere else as it is read
+        from the response's raw file object and returns the reference to it
+        and ``None``, or ``None`` and the body when it is to be kept in the
+        cassette after all
+    """
     body = {'encoding': response.encoding}
-    add_body(response, preserve_exact_body_bytes, body)
+    if record_body is None:
+        add_body(response, preserve_exact_body_bytes, body)
+    else:
+        reference, data = record_body(response.raw)
+        if reference is None:
+            _add_body_data(response, data, preserve_exact_body_bytes, body)
+        else:
+            body.update(reference)
     header_map = HTTPHeaderDict(response.raw.headers)
     headers = {}
     for header_name in header_map.keys():
@@ -112,7 +253,7 @@ def serialize_response(response, preserve_exact_body_bytes):
     }
 
 
-def deserialize_response(serialized):
+def deserialize_response(serialized, blob_store=None, stream=False):
     r = Response()
     r.encoding = serialized['body']['encoding']
     header_dict = HTTPHeaderDict()
@@ -132,15 +273,39 @@ def deserialize_response(serialized):
     else:
         r.status_code = serialized['status_code']
         r.reason = _codes[r.status_code][0].upper()
-    add_urllib3_response(serialized, r, header_dict)
+    add_urllib3_response(serialized, r, header_dict, blob_store, stream)
     return r
 
 
-def add_urllib3_response(serialized, response, headers):
-    if 'base64_string' in serialized['body']:
-        body = io.BytesIO(
-            base64.b64decode(serialized['body']['base64_string'].encode())
-        )
+def add_urllib3_response(serialized, response, headers, blob_store=None,
+                         stream=False):
+    """Attach the recorded body to the response as a urllib3 response.
+
+    When ``stream`` is ``True`` the body is decoded as it is read rather than
+    all at once.
+    """
+    if 'sha256' in serialized['body'] or 'offset' in serialized['body']:
+        # The body was saved in the blob store of the cassette library or
+        # the cassette's sidecar and is read from there as it is needed
+        if blob_store is None:
+            raise BetamaxError('The response body was saved in a blob store '
+                               'but none is available')
+        body = blob_store.open(serialized['body'])
+    elif 'bytes' in serialized['body']:
+        # Raw bytes, e.g., a memoryview from a binary cassette
+        if stream:
+            body = BodyReader(memoryview(serialized['body']['bytes']))
+        else:
+            body = io.BytesIO(serialized['body']['bytes'])
+    elif 'base64_string' in serialized['body']:
+        if stream:
+            body = Base64Reader(serialized['body']['base64_string'])
+        else:
+            body = io.BytesIO(
+                base64.b64decode(serialized['body']['base64_string'].encode())
+            )
+    elif stream:
+        body = TextReader(**serialized['body'])
     else:
         body = body_io(**serialized['body'])
 
@@ -162,6 +327,74 @@ def add_urllib3_response(serialized, response, headers):
     response.raw = h
 
 
+def _overlaps(a, b):
+    """Return whether a and b can share characters in some text."""
+    if a in b or b in a:
+        return True
+    for i in range(1, min(len(a), len(b))):
+        if a.endswith(b[:i]) or b.endswith(a[:i]):
+            return True
+    return False
+
+
+class Replacements(object):
+    """A compiled list of ``(old, new)`` string replacements.
+
+    Applying this to some text gives the same result as calling
+    ``text.replace(old, new)`` for each pair in order. When no replacement
+    can interfere with another one, all of them are made in a single pass
+    with one regular expression. Otherwise, the text is scanned once to see
+    whether anything needs replacing before falling back to replacing each
+    pair in turn.
+    """
+
+    def __init__(self, pairs):
+        self.pairs = [(old, new) for (old, new) in pairs if old != '']
+        self.pattern = None
+        self.lookup = {}
+        if not self.pairs:
+            return
+
+        self.pattern = re.compile(
+            '|'.join(re.escape(old) for (old, _) in self.pairs)
+        )
+        if self._independent():
+            self.lookup = dict(self.pairs)
+
+    def __bool__(self):
+        return bool(self.pairs)
+
+    __nonzero__ = __bool__
+
+    def _independent(self):
+        """Check that one pass is equivalent to replacing pair by pair.
+
+        That is the case when no two strings being replaced can overlap and
+        no replacement can form (part of) a string replaced after it.
+        """
+        for (i, (old, new)) in enumerate(self.pairs):
+            for (j, (other_old, _)) in enumerate(self.pairs):
+                if i != j and _overlaps(old, other_old):
+                    return False
+                if j > i and _overlaps(new, other_old):
+                    return False
+        return True
+
+    def search(self, text):
+        """Return whether any of the replacements applies to the text."""
+        return self.pattern is not None and bool(self.pattern.search(text))
+
+    def apply(self, text):
+        """Return the text with every replacement applied."""
+        if not self.search(text):
+            return text
+        if self.lookup:
+            return self.pattern.sub(lambda m: self.lookup[m.group(0)], text)
+        for (old, new) in self.pairs:
+            text = text.replace(old, new)
+        return text
+
+
 def timestamp():
     stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
     try:
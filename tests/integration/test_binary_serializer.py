@@ -0,0 +1,53 @@
+from .helper import IntegrationHelper
+from betamax import Betamax
+from betamax.cassette import Cassette
+
+
+class TestBinarySerializer(IntegrationHelper):
+    def test_replays_raw_bodies(self):
+        opts = {
+            'serialize_with': 'binary',
+            'preserve_exact_body_bytes': True,
+            'match_requests_on': ['uri', 'method', 'body'],
+        }
+        with Betamax(self.session).use_cassette('test_binary_serializer',
+                                                **opts) as b:
+            self.cassette_path = b.current_cassette.cassette_path
+            recorded = self.session.post('https://httpbin.org/post',
+                                         data={'a': 1})
+
+        with Betamax(self.session).use_cassette('test_binary_serializer',
+                                                record='none',
+                                                **opts) as b:
+            interaction = b.current_cassette.interactions[0].data
+            assert isinstance(interaction['request']['body']['bytes'],
+                              memoryview)
+            assert isinstance(interaction['response']['body']['bytes'],
+                              memoryview)
+            assert 'base64_string' not in interaction['response']['body']
+            replayed = self.session.post('https://httpbin.org/post',
+                                         data={'a': 1})
+
+        assert replayed.content == recorded.content
+        assert replayed.headers == recorded.headers
+
+    def test_replays_with_before_playback_hooks(self):
+        def hook(interaction, cassette):
+            interaction.data['response']['headers']['X-Hooked'] = ['yes']
+
+        opts = {'serialize_with': 'binary', 'preserve_exact_body_bytes': True}
+        with Betamax(self.session).use_cassette('test_binary_hooks',
+                                                **opts) as b:
+            self.cassette_path = b.current_cassette.cassette_path
+            recorded = self.session.get('https://httpbin.org/get')
+
+        Cassette.hooks['before_playback'].append(hook)
+        try:
+            with Betamax(self.session).use_cassette('test_binary_hooks',
+                                                    record='none', **opts):
+                replayed = self.session.get('https://httpbin.org/get')
+        finally:
+            Cassette.hooks['before_playback'].remove(hook)
+
+        assert replayed.content == recorded.content
+        assert replayed.headers['X-Hooked'] == 'yes'
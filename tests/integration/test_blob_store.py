@@ -0,0 +1,139 @@
+import json
+import os
+
+import pytest
+
+from .helper import IntegrationHelper
+from betamax import Betamax
+from betamax.cassette import Cassette
+from betamax.configure import Configuration
+from betamax.serializers.blobs import collect_garbage
+
+
+class TestBlobStore(IntegrationHelper):
+    cassette_created = False
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_dir = str(tmpdir)
+        # The cassette library is configured globally
+        library_dir = Configuration.CASSETTE_LIBRARY_DIR
+        yield
+        Configuration.CASSETTE_LIBRARY_DIR = library_dir
+
+    def use_cassette(self, name, **opts):
+        recorder = Betamax(self.session,
+                           cassette_library_dir=self.cassette_dir)
+        opts.setdefault('blob_threshold', 100)
+        return recorder.use_cassette(name, **opts)
+
+    def blobs(self):
+        return [f for _, _, filenames in os.walk(
+            os.path.join(self.cassette_dir, 'blobs')) for f in filenames]
+
+    def test_stores_large_bodies_once(self):
+        for name in ('first', 'second'):
+            with self.use_cassette(name) as b:
+                recorded = self.session.get('https://httpbin.org/get')
+                cassette_path = b.current_cassette.cassette_path
+
+        with open(cassette_path) as fd:
+            bodies = [i['response']['body']
+                      for i in json.load(fd)['http_interactions']]
+        assert bodies[0] == {'encoding': recorded.encoding,
+                             'sha256': self.blobs()[0]}
+        assert len(self.blobs()) == 1
+
+        with self.use_cassette('second', record='none'):
+            replayed = self.session.get('https://httpbin.org/get')
+        assert replayed.content == recorded.content
+
+        os.unlink(os.path.join(self.cassette_dir, 'first.json'))
+        assert collect_garbage(self.cassette_dir) == []
+        os.unlink(cassette_path)
+        assert collect_garbage(self.cassette_dir) == [bodies[0]['sha256']]
+        assert self.blobs() == []
+
+    def test_sidecar_bodies(self):
+        with self.use_cassette('sidecar', sidecar_bodies=True,
+                               blob_threshold=None) as b:
+            recorded = self.session.get('https://httpbin.org/get')
+            self.session.get('https://httpbin.org/get',
+                             params={'page': 2})
+            cassette_path = b.current_cassette.cassette_path
+
+        with open(cassette_path) as fd:
+            bodies = [i['response']['body']
+                      for i in json.load(fd)['http_interactions']]
+        assert bodies[0]['offset'] == 0
+        assert bodies[1]['offset'] == bodies[0]['length']
+        with open(cassette_path + '.bodies', 'rb') as fd:
+            assert len(fd.read()) == (bodies[0]['length'] +
+                                      bodies[1]['length'])
+        assert self.blobs() == []
+
+        with self.use_cassette('sidecar', record='none'):
+            replayed = self.session.get('https://httpbin.org/get')
+            page = self.session.get('https://httpbin.org/get',
+                                    params={'page': 2}, stream=True)
+            assert page.json()['args'] == {'page': ['2']}
+        assert replayed.content == recorded.content
+
+    def test_rerecording_rewrites_the_sidecar(self):
+        sizes = []
+        for _ in range(3):
+            with self.use_cassette('rerecorded', sidecar_bodies=True,
+                                   blob_threshold=None, record='all') as b:
+                recorded = self.session.get('https://httpbin.org/get')
+                cassette_path = b.current_cassette.cassette_path
+            sizes.append(os.path.getsize(cassette_path + '.bodies'))
+        assert sizes[0] == sizes[1] == sizes[2] == len(recorded.content)
+
+        with self.use_cassette('rerecorded', record='none'):
+            replayed = self.session.get('https://httpbin.org/get')
+        assert replayed.content == recorded.content
+
+    def test_records_bodies_while_they_are_read(self):
+        with self.use_cassette('streamed', blob_threshold=10) as b:
+            recorded = self.session.get('https://httpbin.org/get',
+                                        stream=True)
+            interaction = b.current_cassette.interactions[0]
+            # The body went straight to the store
+            assert interaction.data['response']['body'] == {
+                'encoding': recorded.encoding, 'sha256': self.blobs()[0]}
+            assert interaction.orig_response.raw.read() == b''
+            content = recorded.content
+
+        with self.use_cassette('streamed', record='none'):
+            replayed = self.session.get('https://httpbin.org/get')
+        assert replayed.content == content
+
+    def test_before_record_hooks_see_the_body(self):
+        def scrub(interaction, cassette):
+            interaction.replace('httpbin.org', 'example.org')
+
+        Cassette.hooks['before_record'].append(scrub)
+        try:
+            with self.use_cassette('scrubbed', sidecar_bodies=True,
+                                   blob_threshold=None) as b:
+                self.session.get('https://httpbin.org/get')
+                cassette_path = b.current_cassette.cassette_path
+        finally:
+            Cassette.hooks['before_record'].remove(scrub)
+
+        with open(cassette_path + '.bodies', 'rb') as fd:
+            bodies = fd.read()
+        assert b'example.org' in bodies
+        assert b'httpbin.org' not in bodies
+
+    def test_keeps_bodies_with_placeholders_in_the_cassette(self):
+        placeholders = [{'placeholder': '<HOST>', 'replace': 'httpbin.org'}]
+        with self.use_cassette('placeholders', blob_threshold=10,
+                               placeholders=placeholders):
+            recorded = self.session.get('https://httpbin.org/get')
+
+        assert self.blobs() == []
+        with self.use_cassette('placeholders', record='none',
+                               placeholders=placeholders):
+            replayed = self.session.get('https://httpbin.org/get')
+        assert replayed.content == recorded.content
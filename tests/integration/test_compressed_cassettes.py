@@ -0,0 +1,23 @@
+import gzip
+import json
+
+from .helper import IntegrationHelper
+from betamax import Betamax
+
+
+class TestCompressedCassettes(IntegrationHelper):
+    def test_records_and_replays_compressed_cassettes(self):
+        opts = {'serialize_with': 'json+gz', 'compression_level': 1}
+        with Betamax(self.session).use_cassette('test_compressed',
+                                                **opts) as b:
+            self.cassette_path = b.current_cassette.cassette_path
+            recorded = self.session.get('https://httpbin.org/get')
+
+        assert self.cassette_path.endswith('test_compressed.json.gz')
+        with gzip.open(self.cassette_path, 'rt') as fd:
+            assert len(json.load(fd)['http_interactions']) == 1
+
+        with Betamax(self.session).use_cassette('test_compressed',
+                                                record='none', **opts):
+            replayed = self.session.get('https://httpbin.org/get')
+        assert replayed.content == recorded.content
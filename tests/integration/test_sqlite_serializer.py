@@ -0,0 +1,24 @@
+import os
+
+from .helper import IntegrationHelper
+from betamax import Betamax
+
+
+class TestSQLiteSerializer(IntegrationHelper):
+    def test_records_and_replays(self):
+        opts = {'serialize_with': 'sqlite'}
+        with Betamax(self.session).use_cassette('test_sqlite_serializer',
+                                                **opts) as b:
+            self.cassette_path = os.path.dirname(
+                b.current_cassette.cassette_path)
+            recorded = self.session.get('https://httpbin.org/get')
+            self.session.get('https://httpbin.org/uuid')
+
+        with Betamax(self.session).use_cassette('test_sqlite_serializer',
+                                                record='none',
+                                                **opts) as b:
+            assert len(b.current_cassette.interactions) == 2
+            replayed = self.session.get('https://httpbin.org/get')
+
+        assert replayed.content == recorded.content
+        assert replayed.headers == recorded.headers
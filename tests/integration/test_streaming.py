@@ -0,0 +1,21 @@
+from .helper import IntegrationHelper
+from betamax import Betamax
+from betamax import util
+
+
+class TestStreaming(IntegrationHelper):
+    def test_streamed_replays_decode_lazily(self):
+        opts = {'preserve_exact_body_bytes': True}
+        with Betamax(self.session).use_cassette('test_streaming',
+                                                **opts) as b:
+            self.cassette_path = b.current_cassette.cassette_path
+            recorded = self.session.get('https://httpbin.org/get')
+
+        with Betamax(self.session).use_cassette('test_streaming',
+                                                record='none', **opts):
+            streamed = self.session.get('https://httpbin.org/get',
+                                        stream=True)
+            assert isinstance(streamed.raw._fp, util.Base64Reader)
+            content = b''.join(streamed.iter_content(16))
+
+        assert content == recorded.content
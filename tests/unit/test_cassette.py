@@ -1,12 +1,20 @@
+import base64
 import email
+import json
 import os
 import unittest
 from datetime import datetime
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import pytest
 
 from betamax import __version__
 from betamax.cassette import cassette
+from betamax import matchers
 from betamax import mock_response
 from betamax import recorder
 from betamax import serializers
@@ -169,6 +177,16 @@ class TestSerialization(unittest.TestCase):
         a = 'value'
         assert util.from_list(a) == 'value'
 
+    def test_parse_uri(self):
+        parsed = util.parse_uri('https://example.com:8000/path?b=2&a=1&c#frag')
+        assert parsed.scheme == 'https'
+        assert parsed.netloc == 'example.com:8000'
+        assert parsed.path == '/path'
+        assert parsed.fragment == 'frag'
+        assert parsed.query == (('a', ('1',)), ('b', ('2',)), ('c', ('',)))
+        assert util.parse_uri('https://example.com/path?c&a=1&b=2').query == (
+            parsed.query)
+
     def test_add_urllib3_response(self):
         r = Response()
         r.status_code = 200
@@ -184,6 +202,90 @@ class TestSerialization(unittest.TestCase):
         assert isinstance(r.raw._original_response,
                           mock_response.MockHTTPResponse)
 
+    def test_add_urllib3_response_streams(self):
+        text = decode('h\xe9llo w\xf6rld ') * 1000
+        data = bytes(range(256)) * 100
+        for body, expected in [
+                ({'string': text, 'encoding': 'utf-8'},
+                 text.encode('utf-8')),
+                ({'string': text, 'encoding': 'latin-1'},
+                 text.encode('latin-1')),
+                ({'base64_string': base64.b64encode(data).decode(),
+                  'encoding': None}, data),
+                ({'bytes': memoryview(data), 'encoding': None}, data)]:
+            r = Response()
+            r.status_code = 200
+            r.headers = {}
+            util.add_urllib3_response({'body': body}, r, HTTPHeaderDict(),
+                                      stream=True)
+            assert r.raw.read(7) == expected[:7]
+            assert b''.join(r.iter_content(1000)) == expected[7:]
+
+    def test_readers_decode_lazily(self):
+        data = bytes(range(256)) * 1000
+        reader = util.Base64Reader(base64.b64encode(data).decode())
+        assert reader.read(10) == data[:10]
+        assert reader._position == 16
+        assert reader.read(5) == data[10:15]
+        assert reader.read() == data[15:]
+
+        reader = util.TextReader(decode('\u20ac') * 1000, 'utf-8')
+        assert reader.read(4) == b'\xe2\x82\xac\xe2'
+        assert reader._position == 4
+        assert reader.read() == b'\x82\xac' + b'\xe2\x82\xac' * 998
+
+
+class TestReplacements(unittest.TestCase):
+    def replace_in_turn(self, pairs, text):
+        for (old, new) in pairs:
+            if old:
+                text = text.replace(old, new)
+        return text
+
+    def assert_equivalent(self, pairs, text):
+        replacements = util.Replacements(pairs)
+        assert replacements.apply(text) == self.replace_in_turn(pairs, text)
+        return replacements
+
+    def test_single_pass_when_independent(self):
+        pairs = [('secret', '<SECRET>'), ('password', '<PASSWORD>')]
+        r = self.assert_equivalent(pairs, 'a secret and a password, secret')
+        assert r.lookup
+
+    def test_overlapping_strings_fall_back_to_each_pair(self):
+        pairs = [('bc', 'Y'), ('ab', 'X')]
+        r = self.assert_equivalent(pairs, 'abc')
+        assert not r.lookup
+        assert r.apply('abc') == 'aY'
+
+    def test_replacement_forming_later_string(self):
+        pairs = [('a', 'b'), ('bc', 'Z')]
+        r = self.assert_equivalent(pairs, 'ac')
+        assert r.apply('ac') == 'Z'
+
+    def test_replacement_forming_earlier_string_is_single_pass(self):
+        pairs = [('bc', 'Z'), ('a', 'b')]
+        r = self.assert_equivalent(pairs, 'ac')
+        assert r.lookup
+        assert r.apply('ac') == 'bc'
+
+    def test_empty_strings_are_ignored(self):
+        r = util.Replacements([('', 'x')])
+        assert not r
+        assert r.apply('text') == 'text'
+
+    def test_random_replacements_are_equivalent(self):
+        import random
+        rng = random.Random(0)
+        for _ in range(500):
+            pairs = [(''.join(rng.choice('abc') for _ in range(
+                      rng.randint(0, 3))),
+                      ''.join(rng.choice('abc<>') for _ in range(
+                          rng.randint(0, 3))))
+                     for _ in range(rng.randint(1, 4))]
+            text = ''.join(rng.choice('abcd') for _ in range(12))
+            self.assert_equivalent(pairs, text)
+
 
 def test_cassette_initialization():
     serializers.serializer_registry['test'] = Serializer()
@@ -334,6 +436,146 @@ class TestCassette(unittest.TestCase):
         i = self.cassette.find_match(self.response.request)
         assert i is None
 
+    def test_find_match_returns_first_unused_interaction(self):
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'none'
+        second = self.cassette.save_interaction(self.response,
+                                                self.response.request)
+        assert self.cassette.find_match(self.response.request) is (
+            self.interaction)
+        assert self.cassette.find_match(self.response.request) is second
+        assert self.cassette.find_match(self.response.request) is None
+
+    def test_find_match_sees_interactions_added_after_indexing(self):
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'none'
+        self.interaction.used = True
+        assert self.cassette.find_match(self.response.request) is None
+        new = self.cassette.save_interaction(self.response,
+                                             self.response.request)
+        assert self.cassette.find_match(self.response.request) is new
+
+    def test_find_match_with_unindexed_matchers(self):
+        self.cassette.match_options = set(['uri', 'method', 'headers'])
+        self.cassette.record_mode = 'none'
+        i = self.cassette.find_match(self.response.request)
+        assert i is self.interaction
+        self.response.request.headers['X-Other'] = 'value'
+        self.interaction.used = False
+        assert self.cassette.find_match(self.response.request) is None
+
+    def test_find_match_record_all_replaces_match(self):
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'all'
+        assert self.cassette.find_match(self.response.request) is None
+        assert self.interaction.replaced is True
+        assert self.cassette.find_match(self.response.request) is None
+        assert self.interaction not in self.cassette.interactions
+
+    def test_replaced_interactions_are_not_saved(self):
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'all'
+        self.cassette.find_match(self.response.request)
+        new = self.cassette.save_interaction(self.response,
+                                             self.response.request)
+        self.cassette.eject()
+        assert self.test_serializer.serialize_calls[-1][
+            'http_interactions'] == [new.data]
+
+    def test_counts_used_interactions(self):
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'new_episodes'
+        second = self.cassette.save_interaction(self.response,
+                                                self.response.request)
+        assert self.cassette.find_match(self.response.request) is (
+            self.interaction)
+        assert self.cassette.find_match(self.response.request) is second
+        assert self.cassette._state.counts[cassette.PlaybackState.USED] == 2
+        second.used = False
+        assert self.cassette._state.counts[cassette.PlaybackState.USED] == 1
+        assert self.cassette.find_match(self.response.request) is second
+
+    def test_playback_flags_are_kept_by_the_cassette(self):
+        interaction = cassette.Interaction(self.interaction.data)
+        interaction.ignore()
+        self.cassette.interactions = [self.interaction, interaction]
+        assert interaction._state is self.cassette._state
+        assert interaction.ignored is True
+        assert self.cassette._state.flags == bytearray(
+            [0, cassette.PlaybackState.IGNORED])
+
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'all'
+        self.cassette.find_match(self.response.request)
+        assert self.cassette.interactions == [interaction]
+        assert interaction.ignored is True
+        assert self.interaction.replaced is True
+
+    def test_find_match_from_several_threads(self):
+        import threading
+
+        self.cassette.match_options = set(['uri', 'method'])
+        self.cassette.record_mode = 'none'
+        self.cassette.interactions = [
+            cassette.Interaction(self.interaction.data) for _ in range(50)
+        ]
+        found = []
+
+        def replay():
+            for _ in range(10):
+                found.append(self.cassette.find_match(self.response.request))
+
+        threads = [threading.Thread(target=replay) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(map(id, found))) == 50
+        assert self.cassette._state.counts[cassette.PlaybackState.USED] == 50
+
+    def test_find_match_uses_keys_of_custom_matchers(self):
+        class UserAgentMatcher(matchers.BaseMatcher):
+            name = 'test-user-agent'
+
+            def match(self, request, recorded_request):
+                raise AssertionError('match should not be called')
+
+            def request_key(self, request):
+                return request.headers['User-Agent']
+
+            def recorded_request_key(self, recorded_request):
+                return recorded_request['headers']['User-Agent'][0]
+
+        matchers.matcher_registry['test-user-agent'] = UserAgentMatcher()
+        try:
+            self.cassette.match_options = set(['method', 'test-user-agent'])
+            self.cassette.record_mode = 'none'
+            i = self.cassette.find_match(self.response.request)
+            assert i is self.interaction
+            self.interaction.used = False
+            self.response.request.headers['User-Agent'] = 'other'
+            assert self.cassette.find_match(self.response.request) is None
+        finally:
+            del matchers.matcher_registry['test-user-agent']
+
+    def test_find_match_calls_match_of_subclassed_matchers(self):
+        class LooseURIMatcher(matchers.URIMatcher):
+            name = 'test-loose-uri'
+
+            def match(self, request, recorded_request):
+                return (request.url.split('?')[0] ==
+                        recorded_request['uri'].split('?')[0])
+
+        matchers.matcher_registry['test-loose-uri'] = LooseURIMatcher()
+        try:
+            self.cassette.match_options = set(['method', 'test-loose-uri'])
+            self.cassette.record_mode = 'none'
+            self.response.request.url += '?t=2'
+            i = self.cassette.find_match(self.response.request)
+            assert i is self.interaction
+        finally:
+            del matchers.matcher_registry['test-loose-uri']
+
     def test_find_match__missing_matcher(self):
         self.cassette.match_options = set(['uri', 'method', 'invalid'])
         self.cassette.record_mode = 'none'
@@ -353,6 +595,214 @@ class TestCassette(unittest.TestCase):
         assert self.cassette.earliest_recorded_date is not None
 
 
+class TestCassetteSaving(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_dir = str(tmpdir)
+        self.cassette_path = str(tmpdir.join('saving.json'))
+        interaction = {
+            'request': {
+                'body': {'string': '', 'encoding': 'utf-8'},
+                'headers': {'Authorization': ['<AUTH>']},
+                'method': 'GET',
+                'uri': 'http://example.com/',
+            },
+            'response': {
+                'body': {'string': 'foo', 'encoding': 'utf-8'},
+                'headers': {},
+                'status': {'code': 200, 'message': 'OK'},
+                'url': 'http://example.com/',
+            },
+            'recorded_at': '2013-08-31T00:00:00',
+        }
+        # Indentation which the JSON serializer does not produce lets us tell
+        # whether the file was rewritten.
+        self.contents = json.dumps({
+            'http_interactions': [interaction],
+            'recorded_with': 'betamax/0.0.0',
+        }, indent=4)
+        with open(self.cassette_path, 'w') as fd:
+            fd.write(self.contents)
+
+    def load(self, record_mode, serialize_with='json', **kwargs):
+        return cassette.Cassette(
+            'saving', serialize_with, record_mode=record_mode,
+            cassette_library_dir=self.cassette_dir,
+            placeholders=[{'placeholder': '<AUTH>', 'replace': 'secret'}],
+            **kwargs
+        )
+
+    def record(self, c, url):
+        r = Response()
+        r.status_code = 200
+        r.reason = 'OK'
+        r.encoding = 'utf-8'
+        r.headers = CaseInsensitiveDict({})
+        r.url = url
+        util.add_urllib3_response({
+            'body': {'string': 'foo', 'encoding': 'utf-8'}
+        }, r, HTTPHeaderDict({}))
+        r.request = Request('GET', url,
+                            headers={'Authorization': 'secret'}).prepare()
+        return c.save_interaction(r, r.request)
+
+    def read_journal(self):
+        with open(self.cassette_path + '.journal') as fd:
+            return [json.loads(line) for line in fd]
+
+    def test_unchanged_cassette_is_not_rewritten(self):
+        for record_mode in ('all', 'new_episodes'):
+            c = self.load(record_mode)
+            assert c.interactions[0].data['request']['headers'] == {
+                'Authorization': ['secret']}
+            c.eject()
+            with open(self.cassette_path) as fd:
+                assert fd.read() == self.contents
+
+    def test_modified_cassette_is_rewritten(self):
+        c = self.load('new_episodes')
+        c.interactions[0].replace('foo', 'bar')
+        c.eject()
+        with open(self.cassette_path) as fd:
+            data = json.load(fd)
+        interaction = data['http_interactions'][0]
+        assert interaction['response']['body']['string'] == 'bar'
+        assert interaction['request']['headers'] == {
+            'Authorization': ['<AUTH>']}
+
+    def test_journal_appends_recorded_interactions(self):
+        c = self.load('new_episodes', journal=True)
+        self.record(c, 'http://example.com/one')
+        journal = self.read_journal()
+        assert len(journal) == 1
+        assert journal[0]['request']['headers']['Authorization'] == [
+            '<AUTH>']
+        self.record(c, 'http://example.com/two')
+        assert len(self.read_journal()) == 2
+        # Recorded interactions still replay with the real values
+        assert c.interactions[1].data['request']['headers'][
+            'Authorization'] == ['secret']
+
+        c.eject()
+        with open(self.cassette_path) as fd:
+            assert fd.read() == self.contents
+
+    def test_journal_is_loaded_with_the_cassette(self):
+        c = self.load('new_episodes', journal='fsync')
+        self.record(c, 'http://example.com/one')
+        # Simulate a crash by never ejecting the cassette
+        with open(self.cassette_path + '.journal', 'a') as fd:
+            fd.write('{"request": ')
+
+        c = self.load('none')
+        assert [i.data['request']['uri'] for i in c.interactions] == [
+            'http://example.com/', 'http://example.com/one']
+        assert c.interactions[1].data['request']['headers'][
+            'Authorization'] == ['secret']
+
+    def test_compact_merges_the_journal(self):
+        c = self.load('new_episodes', journal=True)
+        self.record(c, 'http://example.com/one')
+        c.compact()
+        assert not os.path.exists(self.cassette_path + '.journal')
+        with open(self.cassette_path) as fd:
+            data = json.load(fd)
+        assert len(data['http_interactions']) == 2
+        assert data['http_interactions'][1]['request']['headers'][
+            'Authorization'] == ['<AUTH>']
+        assert self.load('none').interactions[1].data['request'][
+            'uri'] == 'http://example.com/one'
+
+    def test_compact_keeps_the_placeholders_expanded(self):
+        c = self.load('new_episodes', journal=True)
+        c.match_options = set(['method', 'uri'])
+        recorded = self.record(c, 'http://example.com/one?token=secret')
+        c.record_mode = 'none'
+        assert c.find_match(recorded.orig_response.request) is recorded
+        recorded.used = False
+
+        c.compact()
+        with open(self.cassette_path) as fd:
+            data = json.load(fd)
+        assert data['http_interactions'][1]['request']['uri'] == (
+            'http://example.com/one?token=<AUTH>')
+        for i in c.interactions:
+            assert i.data['request']['headers'] == {
+                'Authorization': ['secret']}
+        assert c.find_match(recorded.orig_response.request) is recorded
+        assert recorded.as_response().request.url == (
+            'http://example.com/one?token=secret')
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.cassette_dir, 'cache')
+        c = self.load('none', cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        with mock.patch.object(c.serializer.proxied_serializer,
+                               'load') as load:
+            c = self.load('none', cache_dir=cache_dir)
+        assert load.called is False
+        assert c.interactions[0].data['request']['headers'] == {
+            'Authorization': ['secret']}
+
+    def test_loaded_data_is_shared_between_cassettes(self):
+        first = cassette.Cassette('saving', 'json', record_mode='none',
+                                  cassette_library_dir=self.cassette_dir)
+        second = cassette.Cassette('saving', 'json', record_mode='none',
+                                   cassette_library_dir=self.cassette_dir)
+        assert first.interactions[0].data is second.interactions[0].data
+
+        first.interactions[0].used = True
+        first.interactions[0].replace('foo', 'bar')
+        assert first.interactions[0].data['response']['body']['string'] == (
+            'bar')
+        assert second.interactions[0].used is False
+        assert second.interactions[0].data['response']['body'][
+            'string'] == 'foo'
+
+    def test_hooks_get_their_own_copy_of_loaded_data(self):
+        def hook(interaction, cassette):
+            interaction.data['response']['status']['code'] = 500
+
+        cassette.Cassette.hooks['before_playback'].append(hook)
+        try:
+            c = self.load('none')
+        finally:
+            cassette.Cassette.hooks['before_playback'].remove(hook)
+        assert c.interactions[0].data['response']['status']['code'] == 500
+        c = self.load('none')
+        assert c.interactions[0].data['response']['status']['code'] == 200
+
+    def test_jsonl_cassettes_are_appended_to(self):
+        with open(self.cassette_path) as fd:
+            data = json.load(fd)
+        jsonl_path = self.cassette_path[:-len('json')] + 'jsonl'
+        with open(jsonl_path, 'w') as fd:
+            fd.write(serializers.JSONLinesSerializer().serialize(data))
+        with open(jsonl_path) as fd:
+            contents = fd.read()
+
+        c = self.load('new_episodes', serialize_with='jsonl')
+        self.record(c, 'http://example.com/one')
+        c.eject()
+        with open(jsonl_path) as fd:
+            appended = fd.read()
+        assert appended.startswith(contents)
+        assert json.loads(appended[len(contents):])['request'][
+            'headers']['Authorization'] == ['<AUTH>']
+        assert not os.path.exists(jsonl_path + '.journal')
+        c = self.load('none', serialize_with='jsonl')
+        assert len(c.interactions) == 2
+
+    def test_rewriting_merges_the_journal(self):
+        c = self.load('all', journal=True)
+        self.record(c, 'http://example.com/one')
+        c.interactions[0].replace('foo', 'bar')
+        c.eject()
+        assert not os.path.exists(self.cassette_path + '.journal')
+        assert len(self.load('none').interactions) == 2
+
+
 class TestInteraction(unittest.TestCase):
     def setUp(self):
         self.request = {
@@ -394,6 +844,18 @@ class TestInteraction(unittest.TestCase):
         r = self.interaction.as_response()
         assert isinstance(r, Response)
 
+    def test_response_is_built_lazily(self):
+        with mock.patch.object(cassette.Interaction, 'deserialize') as d:
+            interaction = cassette.Interaction(self.json)
+            assert d.called is False
+            interaction.as_response()
+            assert d.call_count == 1
+
+    def test_recorded_response_is_the_last_replayed_response(self):
+        assert isinstance(self.interaction.recorded_response, Response)
+        r = self.interaction.as_response()
+        assert self.interaction.recorded_response is r
+
     def test_as_response_returns_new_instance(self):
         r1 = self.interaction.as_response()
         r2 = self.interaction.as_response()
@@ -437,6 +899,57 @@ class TestInteraction(unittest.TestCase):
         matchers[1] = lambda x: True
         assert self.interaction.match(matchers) is True
 
+    def test_match_key_is_cached(self):
+        class CountingMatcher(matchers.URIMatcher):
+            calls = 0
+
+            def recorded_request_key(self, recorded_request):
+                CountingMatcher.calls += 1
+                return super(CountingMatcher, self).recorded_request_key(
+                    recorded_request)
+
+        matcher = CountingMatcher()
+        key = self.interaction.match_key(matcher)
+        assert key == util.parse_uri('http://example.com/')
+        assert self.interaction.match_key(matcher) == key
+        assert CountingMatcher.calls == 1
+
+    def test_match_key_is_recomputed_after_replacing(self):
+        matcher = matchers.matcher_registry['host']
+        assert self.interaction.match_key(matcher) == 'example.com'
+        self.interaction.replace_in_uri('example.com', 'example.org')
+        assert self.interaction.match_key(matcher) == 'example.org'
+
+    def test_expand_keeps_the_saved_form(self):
+        self.json['response']['body']['string'] = '<BAR>'
+        self.interaction.expand(util.Replacements([('<BAR>', 'bar')]))
+        assert self.interaction.data['response']['body']['string'] == 'bar'
+        assert self.json['response']['body']['string'] == '<BAR>'
+        assert self.interaction.dirty is False
+
+    def test_sanitize_restores_unmodified_interactions(self):
+        self.json['response']['body']['string'] = '<BAR>'
+        self.interaction.expand(util.Replacements([('<BAR>', 'bar')]))
+        self.interaction.sanitize(util.Replacements([('bar', '<BAR>')]))
+        assert self.interaction.data is self.json
+
+    def test_sanitize_scrubs_modified_interactions(self):
+        self.interaction.expand(util.Replacements([]))
+        self.interaction.replace('secret_value', 'other_secret')
+        assert self.interaction.dirty is True
+        self.interaction.sanitize(
+            util.Replacements([('other_secret', '<SECRET>')]))
+        body = self.interaction.data['request']['body']['string']
+        assert body == 'key=value&key2=<SECRET>'
+        assert self.interaction.dirty is False
+
+    def test_sanitize_scrubs_saved_forms_with_sensitive_text(self):
+        self.interaction.expand(util.Replacements([]))
+        self.interaction.sanitize(
+            util.Replacements([('secret_value', '<SECRET>')]))
+        body = self.interaction.data['request']['body']['string']
+        assert body == 'key=value&key2=<SECRET>'
+
     def test_replace(self):
         self.interaction.replace('123456789abcdef', '<AUTH_TOKEN>')
         self.interaction.replace('cookie_value', '<COOKIE_VALUE>')
@@ -2,7 +2,9 @@ import collections
 import copy
 import unittest
 
+from betamax import serializers
 from betamax.configure import Configuration
+from betamax.serializers.cache import memory_cache
 from betamax.cassette import Cassette
 from betamax.recorder import Betamax
 
@@ -31,6 +33,31 @@ class TestConfiguration(unittest.TestCase):
         c.cassette_library_dir = 'foo'
         assert Configuration.CASSETTE_LIBRARY_DIR == 'foo'
 
+    def test_sets_json_backend(self):
+        c = Configuration()
+        default = c.json_backend
+        try:
+            c.json_backend = 'json'
+            serializer = serializers.serializer_registry['json']
+            assert serializer.backend.name == 'json'
+            assert serializer.stored_as_binary is False
+            assert c.json_backend == 'json'
+        finally:
+            c.json_backend = None
+        assert c.json_backend == default
+
+    def test_sets_memory_cache_limits(self):
+        c = Configuration()
+        entries, size = c.max_cached_cassettes, c.max_cached_cassette_bytes
+        try:
+            c.max_cached_cassettes = 0
+            c.max_cached_cassette_bytes = 1024
+            assert memory_cache.max_entries == 0
+            assert memory_cache.max_bytes == 1024
+        finally:
+            c.max_cached_cassettes = entries
+            c.max_cached_cassette_bytes = size
+
     def test_is_a_context_manager(self):
         with Configuration() as c:
             assert isinstance(c, Configuration)
@@ -72,6 +72,28 @@ class TestMatchers(unittest.TestCase):
             'method': 'GET',
         })
 
+    def test_body_matcher_keys(self):
+        matcher = matchers.matcher_registry['body']
+        request_key = matcher.request_key(self.p)
+        assert request_key == matcher.recorded_request_key(
+            {'body': {'string': 'Foo bar', 'encoding': 'utf-8'}}
+        )
+        assert request_key == matcher.recorded_request_key(
+            {'body': {'base64_string': 'Rm9vIGJhcg==', 'encoding': 'utf-8'}}
+        )
+        assert request_key != matcher.recorded_request_key({'body': b''})
+        p = self.p.copy()
+        p.body = None
+        assert matcher.request_key(p) == matcher.recorded_request_key(
+            {'body': {'string': '', 'encoding': 'utf-8'}}
+        )
+
+    def test_body_matcher_with_base64_body(self):
+        match = matchers.matcher_registry['body'].match
+        assert match(self.p, {
+            'body': {'base64_string': 'Rm9vIGJhcg==', 'encoding': 'utf-8'},
+        })
+
     def test_digest_matcher(self):
         match = matchers.matcher_registry['digest-auth'].match
         assert match(self.p, {'headers': {}})
@@ -158,6 +180,32 @@ class TestMatchers(unittest.TestCase):
         other_uri = 'http://example.com/path/to?form=value&query=string'
         assert match(self.p, {'uri': other_uri}) is True
 
+    def test_keys_agree_with_match(self):
+        recorded = [
+            {'method': 'GET',
+             'uri': 'http://example.com/path/to/end/point?query=string'},
+            {'method': 'POST', 'uri': 'https://example.com/?query=string'},
+            {'method': 'GET', 'uri': 'http://example.com:8000/path/to/end/'},
+            {'method': 'GET', 'uri': self.alt_url},
+            {'method': 'GET', 'uri': 'http://example.com'},
+        ]
+        for name in ('host', 'method', 'path', 'query', 'uri'):
+            matcher = matchers.matcher_registry[name]
+            request_key = matcher.request_key(self.p)
+            for recorded_request in recorded:
+                keys_equal = (
+                    request_key ==
+                    matcher.recorded_request_key(recorded_request)
+                )
+                assert keys_equal is matcher.match(self.p, recorded_request)
+
+    def test_query_key_is_order_independent(self):
+        matcher = matchers.matcher_registry['query']
+        self.p.url = self.alt_url
+        assert matcher.request_key(self.p) == matcher.recorded_request_key(
+            {'uri': 'http://example.com/?foo=bar&query=string'}
+        )
+
 
 class TestBaseMatcher(unittest.TestCase):
     def setUp(self):
@@ -172,3 +220,37 @@ class TestBaseMatcher(unittest.TestCase):
         self.Matcher.name = 'test'
         m = self.Matcher()
         self.assertRaises(NotImplementedError, m.match, None, None)
+
+    def test_keys_are_optional(self):
+        self.Matcher.name = 'test'
+        m = self.Matcher()
+        assert m.supports_keys() is False
+        assert m.request_key(None) is NotImplemented
+        assert m.recorded_request_key(None) is NotImplemented
+
+    def test_supports_keys_requires_both_methods(self):
+        class KeyedMatcher(self.Matcher):
+            name = 'test'
+
+            def request_key(self, request):
+                return request
+
+        assert KeyedMatcher().supports_keys() is False
+        KeyedMatcher.recorded_request_key = lambda self, recorded: recorded
+        assert KeyedMatcher().supports_keys() is True
+
+    def test_subclasses_overriding_only_match_do_not_support_keys(self):
+        class LooseURIMatcher(matchers.URIMatcher):
+            def match(self, request, recorded_request):
+                return True
+
+        class KeyedURIMatcher(LooseURIMatcher):
+            def request_key(self, request):
+                return None
+
+            def recorded_request_key(self, recorded_request):
+                return None
+
+        assert matchers.URIMatcher().supports_keys() is True
+        assert LooseURIMatcher().supports_keys() is False
+        assert KeyedURIMatcher().supports_keys() is True
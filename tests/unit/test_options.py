@@ -47,6 +47,32 @@ class TestOptions(unittest.TestCase):
         with pytest.raises(exceptions.BodyBytesValidationError):
             Options(data)
 
+    def test_raise_on_invalid_blob_threshold(self):
+        for threshold in (-1, '1', True):
+            data = self.data.copy()
+            data['blob_threshold'] = threshold
+            with pytest.raises(exceptions.BlobThresholdValidationError):
+                Options(data)
+
+    def test_raise_on_invalid_cache_dir(self):
+        data = self.data.copy()
+        data['cache_dir'] = 1
+        with pytest.raises(exceptions.CacheDirValidationError):
+            Options(data)
+
+    def test_raise_on_invalid_compression_level(self):
+        for level in (-1, 10, '9', True):
+            data = self.data.copy()
+            data['compression_level'] = level
+            with pytest.raises(exceptions.CompressionLevelValidationError):
+                Options(data)
+
+    def test_raise_on_invalid_journal(self):
+        data = self.data.copy()
+        data['journal'] = 'sometimes'
+        with pytest.raises(exceptions.JournalValidationError):
+            Options(data)
+
     def test_raise_on_invalid_matchers(self):
         data = self.data.copy()
         data['match_requests_on'] = ['foo', 'bar', 'bogus']
@@ -1,12 +1,32 @@
 """Tests for serializers."""
+from contextlib import closing
+import io
+import json
 import os
+import sqlite3
 import unittest
+import zipfile
+import zlib
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 import pytest
 
+from betamax import exceptions
+from betamax import serializers
 from betamax.serializers import base
+from betamax.serializers import cache
+from betamax.serializers import binary_serializer
+from betamax.serializers import blobs
+from betamax.serializers import compressed
 from betamax.serializers import json_serializer
+from betamax.serializers import jsonl_serializer
+from betamax.serializers import archive
 from betamax.serializers import proxy
+from betamax.serializers import sqlite_serializer
 
 
 class TestJSONSerializer(unittest.TestCase):
@@ -32,6 +52,725 @@ class TestJSONSerializer(unittest.TestCase):
                 serializer.generate_cassette_name(self.cassette_dir,
                                                   self.cassette_name))
 
+    def installed_backends(self):
+        """Return a serializer for each installed JSON backend."""
+        for name in json_serializer.backends:
+            serializer = json_serializer.JSONSerializer()
+            try:
+                serializer.use_backend(name)
+            except ImportError:
+                continue
+            yield serializer
+
+    def test_dump_matches_serialize(self):
+        """Verify writing to a file produces the same JSON."""
+        for serializer in self.installed_backends():
+            for cassette_data in ({}, {'http_interactions': []}, {
+                    'http_interactions': [{'a': [1, u'\u2603']},
+                                          {'b': None, 'c': u'\ud800'}],
+                    'recorded_with': 'betamax/test'}):
+                if serializer.stored_as_binary:
+                    fileobj = io.BytesIO()
+                else:
+                    fileobj = io.StringIO()
+                serializer.dump(cassette_data, fileobj)
+                serialized = serializer.serialize(cassette_data)
+                assert fileobj.getvalue() == serialized
+                assert serializer.deserialize(serialized) == cassette_data
+
+    def test_backends_read_each_others_cassettes(self):
+        """Verify cassettes do not depend on the backend which wrote them."""
+        cassette_data = {
+            'http_interactions': [{'uri': 'http://example.com/\u2603'}],
+            'recorded_with': 'betamax/test',
+        }
+        serializers = list(self.installed_backends())
+        for writer in serializers:
+            serialized = writer.serialize(cassette_data)
+            if not writer.stored_as_binary:
+                serialized = serialized.encode('utf-8')
+            for reader in serializers:
+                if not reader.stored_as_binary:
+                    data = reader.deserialize(serialized.decode('utf-8'))
+                else:
+                    data = reader.deserialize(serialized)
+                assert data == cassette_data
+
+    def test_default_backend_writes_with_the_standard_library(self):
+        """Verify cassettes do not depend on what is installed by default."""
+        serializer = json_serializer.JSONSerializer()
+        standard = json_serializer.JSONSerializer()
+        standard.use_backend('json')
+        cassette_data = {'http_interactions': [{'uri': u'\u2603'}]}
+        assert serializer.stored_as_binary is False
+        assert (serializer.serialize(cassette_data) ==
+                standard.serialize(cassette_data))
+        assert serializer.backend.loads is next(
+            self.installed_backends()).backend.loads
+
+    def test_unknown_backend(self):
+        """Verify unknown backends are rejected."""
+        with pytest.raises(ValueError):
+            json_serializer.JSONSerializer().use_backend('yaml')
+
+    def test_subclasses_overriding_serialize_keep_text_files(self):
+        """Verify subclasses using the string API keep working."""
+        class PrettyJSONSerializer(json_serializer.JSONSerializer):
+            def serialize(self, cassette_data):
+                return json.dumps(cassette_data, indent=2)
+
+        serializer = PrettyJSONSerializer()
+        assert serializer.stored_as_binary is False
+        fileobj = io.StringIO()
+        serializer.dump({'http_interactions': []}, fileobj)
+        assert fileobj.getvalue() == '{\n  "http_interactions": []\n}'
+
+
+class TestJSONLinesSerializer(unittest.TestCase):
+    """Tests around the JSONLinesSerializer."""
+
+    def setUp(self):
+        """Fixture setup."""
+        self.serializer = jsonl_serializer.JSONLinesSerializer()
+        self.cassette_data = {
+            'http_interactions': [{'request': {'uri': 'http://a/'}},
+                                  {'request': {'uri': 'http://b/'}}],
+            'recorded_with': 'betamax/test',
+        }
+
+    def test_generate_cassette_name(self):
+        """Verify the behaviour of generate_cassette_name."""
+        assert (os.path.join('fake_dir', 'cassette_name.jsonl') ==
+                self.serializer.generate_cassette_name('fake_dir',
+                                                       'cassette_name'))
+
+    def test_serialize_writes_one_interaction_per_line(self):
+        """Verify the header is followed by the interactions."""
+        lines = self.serializer.serialize(self.cassette_data).splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {'recorded_with': 'betamax/test'},
+            {'request': {'uri': 'http://a/'}},
+            {'request': {'uri': 'http://b/'}},
+        ]
+
+    def test_round_trip(self):
+        """Verify we deserialize what we serialized."""
+        serialized = self.serializer.serialize(self.cassette_data)
+        assert self.serializer.deserialize(serialized) == self.cassette_data
+
+    def test_load_skips_an_incomplete_last_line(self):
+        """Verify a line torn by an interrupted append is ignored."""
+        serialized = (self.serializer.serialize(self.cassette_data) +
+                      self.serializer.serialize_interaction({'c': 1}) +
+                      '{"request": ')
+        data = self.serializer.load(io.StringIO(serialized))
+        assert data['http_interactions'][-1] == {'c': 1}
+        assert len(data['http_interactions']) == 3
+
+    def test_load_rejects_corrupted_lines(self):
+        """Verify only the last line may be incomplete."""
+        serialized = (self.serializer.serialize(self.cassette_data) +
+                      '{"request": \n' +
+                      self.serializer.serialize_interaction({'c': 1}))
+        with pytest.raises(ValueError):
+            self.serializer.load(io.StringIO(serialized))
+
+    def test_deserialize_empty_cassette(self):
+        """Verify an empty file is an empty cassette."""
+        assert self.serializer.deserialize('') == {}
+
+
+class TestBinarySerializer(unittest.TestCase):
+    """Tests around the BinarySerializer."""
+
+    def setUp(self):
+        """Fixture setup."""
+        self.serializer = binary_serializer.BinarySerializer()
+        self.cassette_data = {
+            'http_interactions': [{
+                'request': {
+                    'body': {'encoding': 'utf-8', 'string': 'a=1'},
+                    'headers': {'Accept': ['*/*']},
+                    'method': 'POST',
+                    'uri': u'http://example.com/\u2603',
+                },
+                'response': {
+                    'body': {'encoding': None,
+                             'base64_string': 'AAEC/w=='},
+                    'headers': {},
+                    'status': {'code': 200, 'message': 'OK'},
+                    'url': 'http://example.com/',
+                },
+                'recorded_at': '2013-08-31T00:00:00',
+                'flags': [True, False, 1.5, -3],
+            }],
+            'recorded_with': 'betamax/test',
+        }
+
+    def test_generate_cassette_name(self):
+        """Verify the behaviour of generate_cassette_name."""
+        assert (os.path.join('fake_dir', 'cassette_name.bin') ==
+                self.serializer.generate_cassette_name('fake_dir',
+                                                       'cassette_name'))
+
+    def test_stores_raw_body_bytes(self):
+        """Verify bodies are stored and loaded without base64."""
+        serialized = self.serializer.serialize(self.cassette_data)
+        assert b'\x00\x01\x02\xff' in serialized
+        assert b'AAEC/w==' not in serialized
+
+        data = self.serializer.deserialize(serialized)
+        body = data['http_interactions'][0]['response']['body']
+        assert isinstance(body['bytes'], memoryview)
+        assert body['bytes'].tobytes() == b'\x00\x01\x02\xff'
+        assert body['encoding'] is None
+        assert 'base64_string' not in body
+        # The data being serialized is left untouched
+        assert 'base64_string' in (
+            self.cassette_data['http_interactions'][0]['response']['body'])
+
+    def test_round_trip(self):
+        """Verify everything but the bodies is deserialized unchanged."""
+        serialized = self.serializer.serialize(self.cassette_data)
+        data = self.serializer.deserialize(serialized)
+        expected = self.serializer.deserialize(
+            self.serializer.serialize(data))
+        assert data['recorded_with'] == 'betamax/test'
+        interaction = data['http_interactions'][0]
+        original = self.cassette_data['http_interactions'][0]
+        assert interaction['request'] == original['request']
+        assert interaction['flags'] == original['flags']
+        assert expected == data
+
+    def test_dump_matches_serialize(self):
+        """Verify writing to a file produces the same bytes."""
+        fileobj = io.BytesIO()
+        self.serializer.dump(self.cassette_data, fileobj)
+        assert fileobj.getvalue() == self.serializer.serialize(
+            self.cassette_data)
+
+    def test_deserialize_invalid_cassettes(self):
+        """Verify empty, foreign and truncated files are empty cassettes."""
+        serialized = self.serializer.serialize(self.cassette_data)
+        assert self.serializer.deserialize(b'') == {}
+        assert self.serializer.deserialize(b'{"http_interactions": []}') == {}
+        assert self.serializer.deserialize(serialized[:-3]) == {}
+
+
+class TestCompressedSerializer(unittest.TestCase):
+    """Tests around compressed serializers."""
+
+    def setUp(self):
+        """Fixture setup."""
+        self.cassette_data = {
+            'http_interactions': [{
+                'request': {'body': '', 'uri': 'http://a/'},
+                'response': {'body': {'base64_string': 'AAEC/w=='}},
+            }] * 50,
+            'recorded_with': 'betamax/test',
+        }
+
+    def test_registry_resolves_compressed_names(self):
+        """Verify names like json+gz wrap the registered serializer."""
+        for compression in compressed.compressors:
+            name = 'jsonl+' + compression
+            assert name in serializers.serializer_registry
+            serializer = serializers.serializer_registry[name]
+            assert serializer.name == name
+            assert serializer.stored_as_binary is True
+            assert isinstance(serializer.serializer,
+                              serializers.JSONLinesSerializer)
+        assert 'json+rar' not in serializers.serializer_registry
+        assert 'bogus+gz' not in serializers.serializer_registry
+        assert serializers.serializer_registry.get('json+rar') is None
+
+    def test_generate_cassette_name(self):
+        """Verify the compression is added as an extension."""
+        serializer = serializers.serializer_registry['json+gz']
+        assert (os.path.join('fake_dir', 'cassette_name.json.gz') ==
+                serializer.generate_cassette_name('fake_dir',
+                                                  'cassette_name'))
+
+    def test_round_trip(self):
+        """Verify every compressor round trips text and binary data."""
+        for compression in compressed.compressors:
+            for name in ('json', 'jsonl', 'binary'):
+                serializer = serializers.serializer_registry[
+                    name + '+' + compression]
+                serialized = serializer.serialize(self.cassette_data)
+                assert len(serialized) < len(
+                    serializer.serializer.serialize(self.cassette_data))
+                assert (serializer.deserialize(serialized) ==
+                        serializer.serializer.deserialize(
+                            serializer.serializer.serialize(
+                                self.cassette_data)))
+
+    def test_deserialize_empty_and_corrupt_cassettes(self):
+        """Verify unreadable cassettes are empty cassettes."""
+        for compression in compressed.compressors:
+            serializer = serializers.serializer_registry[
+                'json+' + compression]
+            serialized = serializer.serialize(self.cassette_data)
+            assert serializer.deserialize(b'') == {}
+            assert serializer.deserialize(b'not compressed') == {}
+            assert serializer.deserialize(serialized[:-8]) == {}
+
+    def test_compression_level(self):
+        """Verify the compression level is used."""
+        serializer = serializers.serializer_registry['json+zlib']
+        default = serializer.serialize(self.cassette_data)
+        serializer.compression_level = 0
+        assert len(serializer.serialize(self.cassette_data)) > len(default)
+
+    def test_compression_levels_of_every_compressor(self):
+        """Verify every compressor accepts the lowest and highest levels."""
+        for compression in compressed.compressors:
+            for level in (0, 9):
+                serializer = serializers.serializer_registry[
+                    'json+' + compression].for_cassette('fake_dir', level)
+                serialized = serializer.serialize(self.cassette_data)
+                assert serializer.deserialize(serialized) == (
+                    self.cassette_data)
+
+    def test_output_is_reproducible(self):
+        """Verify the same data always produces the same file."""
+        serializer = serializers.serializer_registry['json+gz']
+        assert (serializer.serialize(self.cassette_data) ==
+                serializer.serialize(self.cassette_data))
+
+    def test_zlib_reader_reads_in_chunks(self):
+        """Verify the zlib reader only decompresses what is asked for."""
+        data = b'x' * (compressed.CHUNK_SIZE * 4)
+        reader = compressed.ZlibReader(io.BytesIO(zlib.compress(data)))
+        assert reader.read(10) == b'x' * 10
+        assert reader.read() == data[10:]
+
+    def test_proxy_sets_the_compression_level(self):
+        """Verify the compression_level option reaches the serializer."""
+        serializer_proxy = proxy.SerializerProxy.find(
+            'json+xz', 'fake_dir', 'cassette_name', compression_level=1)
+        assert serializer_proxy.proxied_serializer.compression_level == 1
+        assert serializer_proxy.cassette_path == os.path.join(
+            'fake_dir', 'cassette_name.json.xz')
+
+
+class TestCompressionDictionary(unittest.TestCase):
+    """Tests around the zdict compressor and its dictionary."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_dir = str(tmpdir)
+        self.serializer = proxy.SerializerProxy.find(
+            'json+zdict', self.cassette_dir, 'cassette'
+        ).proxied_serializer
+
+    def cassette_data(self, n):
+        return {
+            'http_interactions': [{
+                'request': {
+                    'body': {'encoding': 'utf-8', 'string': ''},
+                    'headers': {'Accept': ['application/json'],
+                                'User-Agent': ['python-requests/2.0']},
+                    'method': 'GET',
+                    'uri': 'https://api.example.com/items/{0}'.format(n),
+                },
+                'response': {
+                    'body': {'encoding': 'utf-8',
+                             'string': '{{"id": {0}}}'.format(n)},
+                    'headers': {'Content-Type': ['application/json'],
+                                'Server': ['example']},
+                    'status': {'code': 200, 'message': 'OK'},
+                    'url': 'https://api.example.com/items/{0}'.format(n),
+                },
+                'recorded_at': '2013-08-31T00:00:00',
+            }],
+            'recorded_with': 'betamax/test',
+        }
+
+    def write(self, name, data):
+        path = os.path.join(self.cassette_dir, name)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+        return path
+
+    def test_works_without_a_dictionary(self):
+        """Verify cassettes are plain zlib streams until one is trained."""
+        serialized = self.serializer.serialize(self.cassette_data(1))
+        assert zlib.decompress(serialized)
+        assert self.serializer.deserialize(serialized) == (
+            self.cassette_data(1))
+
+    def test_trained_dictionary_improves_compression(self):
+        """Verify small cassettes compress better with a dictionary."""
+        for n in range(10):
+            self.write('cassette{0}.json'.format(n), json.dumps(
+                self.cassette_data(n)).encode())
+        without = len(self.serializer.serialize(self.cassette_data(42)))
+
+        dictionary = compressed.train_dictionary(self.cassette_dir)
+        assert 0 < len(dictionary) <= compressed.DICTIONARY_SIZE
+        assert compressed.load_dictionary(self.cassette_dir) == dictionary
+        serialized = self.serializer.serialize(self.cassette_data(42))
+        assert len(serialized) < without * 0.6
+        assert self.serializer.deserialize(serialized) == (
+            self.cassette_data(42))
+
+    def test_retraining_recompresses_cassettes(self):
+        """Verify cassettes stay readable when the dictionary changes."""
+        for n in range(3):
+            self.write('cassette{0}.json'.format(n), json.dumps(
+                self.cassette_data(n)).encode())
+        compressed.train_dictionary(self.cassette_dir, size=64)
+        path = self.write('cassette.json.zz', self.serializer.serialize(
+            self.cassette_data(7)))
+        self.write('empty.json.zz', b'')
+
+        compressed.train_dictionary(self.cassette_dir)
+        with open(path, 'rb') as fd:
+            assert self.serializer.deserialize(fd.read()) == (
+                self.cassette_data(7))
+
+    def test_refuses_a_different_dictionary(self):
+        """Verify a mismatched dictionary is an error, not an empty file."""
+        self.write(compressed.DICTIONARY_NAME, b'"headers": {')
+        serialized = self.serializer.serialize(self.cassette_data(1))
+        self.write(compressed.DICTIONARY_NAME, b'"body": {')
+        with pytest.raises(exceptions.BetamaxError):
+            self.serializer.deserialize(serialized)
+
+
+class TestSQLiteSerializer(unittest.TestCase):
+    """Tests around the SQLite serializer."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_dir = str(tmpdir)
+        self.interaction = {
+            'request': {'method': 'GET', 'uri': 'http://a/',
+                        'headers': {}, 'body': ''},
+            'response': {'headers': {}, 'url': 'http://a/',
+                         'body': {'encoding': 'utf-8',
+                                  'base64_string': 'AAEC/w=='}},
+            'recorded_at': '2013-08-31T00:00:01',
+        }
+        self.cassette_data = {'http_interactions': [self.interaction],
+                              'recorded_with': 'betamax/test'}
+
+    def find(self, cassette_name='cassette'):
+        serializer_proxy = proxy.SerializerProxy.find(
+            'sqlite', self.cassette_dir, cassette_name)
+        serializer_proxy.allow_serialization = True
+        return serializer_proxy
+
+    def test_generate_cassette_name(self):
+        """Verify cassettes are addressed inside the database."""
+        assert self.find().cassette_path == os.path.join(
+            self.cassette_dir, 'cassettes.sqlite3', 'cassette')
+
+    def test_cannot_be_compressed(self):
+        """Verify the registry does not wrap it with a compressor."""
+        assert 'sqlite+gz' not in serializers.serializer_registry
+
+    def test_round_trip(self):
+        """Verify cassettes are stored as rows with blob bodies."""
+        serializer_proxy = self.find()
+        assert serializer_proxy.exists() is False
+        assert serializer_proxy.deserialize() == {}
+        serializer_proxy.serialize(self.cassette_data)
+        assert serializer_proxy.exists() is True
+        assert self.find('other').exists() is False
+        assert os.listdir(self.cassette_dir) == ['cassettes.sqlite3']
+
+        data = self.find().deserialize()
+        interaction = data['http_interactions'][0]
+        assert data['recorded_with'] == 'betamax/test'
+        assert interaction['request'] == self.interaction['request']
+        assert interaction['response']['body'] == {
+            'encoding': 'utf-8', 'bytes': b'\x00\x01\x02\xff'}
+
+        database = os.path.join(self.cassette_dir, 'cassettes.sqlite3')
+        with closing(sqlite3.connect(database)) as connection:
+            assert connection.execute(
+                'SELECT cassette, method, uri, response_body '
+                'FROM interactions').fetchall() == [
+                ('cassette', 'GET', 'http://a/', b'\x00\x01\x02\xff')]
+            # Requests are matched in memory, not by the database
+            assert connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND "
+                "tbl_name = 'interactions' AND sql IS NOT NULL"
+            ).fetchall() == []
+
+    def test_append(self):
+        """Verify interactions are appended to the cassette."""
+        serializer_proxy = self.find()
+        assert serializer_proxy.appendable is True
+        serializer_proxy.serialize(self.cassette_data)
+        before = serializer_proxy.deserialize()
+        interaction = dict(self.interaction, recorded_at='2020')
+        serializer_proxy.append(interaction)
+
+        data = self.find().deserialize()
+        assert data is not before
+        assert [i['recorded_at'] for i in data['http_interactions']] == [
+            '2013-08-31T00:00:01', '2020']
+        assert serializer_proxy.read_journal() == []
+
+        serializer_proxy.serialize({'http_interactions': [],
+                                    'recorded_with': 'betamax/test'})
+        assert self.find().deserialize()['http_interactions'] == []
+
+    def test_schema_is_created_once(self):
+        """Verify the schema is not created again for every connection."""
+        with mock.patch.object(sqlite_serializer, '_initialize',
+                               wraps=sqlite_serializer._initialize) as init:
+            self.find().serialize(self.cassette_data)
+            self.find().deserialize()
+            self.find().append(self.interaction)
+        assert init.call_count == 1
+
+    def test_writes_only_change_their_own_cassette(self):
+        """Verify a cassette stays cached while others are recorded."""
+        self.find().serialize(self.cassette_data)
+        other = self.find('other')
+        other.serialize(self.cassette_data)
+        cached = self.find().deserialize()
+        other.append(dict(self.interaction, recorded_at='2020'))
+        assert self.find().deserialize() is cached
+
+        database = os.path.join(self.cassette_dir, 'cassettes.sqlite3')
+        with closing(sqlite3.connect(database)) as connection:
+            connection.execute('PRAGMA user_version = 1')
+        assert self.find().deserialize() is not cached
+
+
+class TestArchive(unittest.TestCase):
+    """Tests around cassette libraries packed in a zip archive."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.overlay = str(tmpdir.join('cassettes'))
+        self.archive_path = str(tmpdir.join('cassettes.zip'))
+        os.makedirs(os.path.join(self.overlay, 'nested'))
+        self.cassette_data = {'http_interactions': [],
+                              'recorded_with': 'betamax/test'}
+        for name in ('first', 'nested/second'):
+            with open(os.path.join(self.overlay, name + '.json'), 'w') as fd:
+                json.dump(dict(self.cassette_data, name=name), fd)
+
+    def find(self, cassette_name):
+        serializer_proxy = proxy.SerializerProxy.find(
+            'json', self.archive_path, cassette_name)
+        serializer_proxy.allow_serialization = True
+        return serializer_proxy
+
+    def test_pack_creates_the_archive(self):
+        """Verify packing a directory moves its cassettes into an archive."""
+        assert archive.overlay_directory(self.archive_path) == self.overlay
+        assert archive.pack(self.archive_path) == [
+            'first.json', 'nested/second.json']
+        assert archive.is_archive(self.archive_path)
+        assert os.listdir(os.path.join(self.overlay, 'nested')) == []
+
+    def test_reads_members(self):
+        """Verify cassettes are read from the archive."""
+        archive.pack(self.archive_path)
+        serializer_proxy = self.find('nested/second')
+        assert serializer_proxy.archive_path == self.archive_path
+        assert serializer_proxy.exists() is True
+        assert serializer_proxy.deserialize()['name'] == 'nested/second'
+        assert self.find('missing').exists() is False
+        assert self.find('missing').deserialize() == {}
+        assert os.listdir(os.path.join(self.overlay, 'nested')) == []
+
+    def test_recordings_go_to_the_overlay(self):
+        """Verify cassettes are written to the overlay until packed."""
+        archive.pack(self.archive_path)
+        first = self.find('first')
+        first.serialize(dict(self.cassette_data, name='changed'))
+        self.find('third').serialize(self.cassette_data)
+        assert sorted(os.listdir(self.overlay)) == [
+            'first.json', 'nested', 'third.json']
+        assert self.find('first').deserialize()['name'] == 'changed'
+
+        assert archive.pack(self.archive_path) == ['first.json',
+                                                   'third.json']
+        assert os.listdir(self.overlay) == ['nested']
+        with zipfile.ZipFile(self.archive_path) as packed:
+            assert sorted(packed.namelist()) == [
+                'first.json', 'nested/second.json', 'third.json']
+        assert self.find('first').deserialize()['name'] == 'changed'
+
+    def test_appending_copies_the_cassette_out(self):
+        """Verify cassettes are extracted to the overlay before appending."""
+        archive.pack(self.archive_path)
+        first = self.find('first')
+        first.append({'request': {}})
+        assert first.read_journal() == [{'request': {}}]
+        with open(first.cassette_path) as fd:
+            assert json.load(fd)['name'] == 'first'
+
+
+class TestBlobStore(unittest.TestCase):
+    """Tests around the blob store for large bodies."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_dir = str(tmpdir)
+        self.store = blobs.BlobStore(self.cassette_dir)
+
+    def test_put_and_get(self):
+        """Verify blobs are stored once under their digest."""
+        digest = self.store.put(b'data')
+        assert self.store.put(b'data') == digest
+        assert self.store.path(digest) == os.path.join(
+            self.cassette_dir, 'blobs', digest[:2], digest)
+        assert self.store.get(digest) == b'data'
+        with pytest.raises(exceptions.BetamaxError):
+            self.store.get('0' * 64)
+
+    def test_stored_body(self):
+        """Verify only bodies above the threshold are stored."""
+        small = {'encoding': 'utf-8', 'string': 'abc'}
+        assert self.store.stored_body(small, 3) is small
+        assert self.store.stored_body('old style body', 0) == 'old style body'
+        stored = self.store.stored_body(small, 2)
+        assert stored == {'encoding': 'utf-8',
+                          'sha256': self.store.put(b'abc')}
+        assert self.store.stored_body(stored, 0) is stored
+        assert self.store.stored_body(
+            {'encoding': None, 'base64_string': 'YWJj'}, 2)['sha256'] == (
+            stored['sha256'])
+
+    def test_sidecar_body(self):
+        """Verify bodies are appended to the sidecar once."""
+        self.store.sidecar_path = os.path.join(self.cassette_dir,
+                                               'c.json.bodies')
+        first = self.store.sidecar_body({'encoding': 'utf-8',
+                                         'string': 'first'})
+        second = self.store.sidecar_body({'encoding': None,
+                                          'base64_string': 'AAEC'})
+        assert first == {'encoding': 'utf-8', 'offset': 0, 'length': 5}
+        assert second == {'encoding': None, 'offset': 5, 'length': 3}
+        assert self.store.sidecar_body(
+            {'encoding': 'utf-8', 'string': 'first'}) == first
+        assert self.store.sidecar_body(first) is first
+        with open(self.store.sidecar_path, 'rb') as fd:
+            assert fd.read() == b'first\x00\x01\x02'
+
+        reader = self.store.open(second)
+        assert isinstance(reader, blobs.BodyReader)
+        assert reader.read(1) == b'\x00'
+        assert reader.read() == b'\x01\x02'
+        assert reader.read() == b''
+        assert self.store.open(first).read() == b'first'
+        with pytest.raises(exceptions.BetamaxError):
+            self.store.open({'offset': 5, 'length': 4})
+
+    def test_record(self):
+        """Verify bodies are stored a chunk at a time while they are read."""
+        self.store.sidecar_path = os.path.join(self.cassette_dir,
+                                               'c.json.bodies')
+        data = os.urandom(blobs.CHUNK_SIZE * 2 + 1)
+        assert self.store.record(io.BytesIO(data), threshold=10) == (
+            {'sha256': self.store.put(data)}, None)
+        assert self.store.record(io.BytesIO(b'small'), threshold=10) == (
+            None, b'small')
+        assert os.listdir(os.path.join(self.cassette_dir, 'blobs')) == [
+            self.store.put(data)[:2]]
+
+        assert self.store.record(io.BytesIO(b'first')) == (
+            {'offset': 0, 'length': 5}, None)
+        assert self.store.record(io.BytesIO(b'second'), threshold=10,
+                                 sidecar=True) == (
+            {'offset': 5, 'length': 6}, None)
+        assert self.store.record(io.BytesIO(b'first')) == (
+            {'offset': 0, 'length': 5}, None)
+        assert self.store.record(io.BytesIO(b'')) == (None, b'')
+        with open(self.store.sidecar_path, 'rb') as fd:
+            assert fd.read() == b'firstsecond'
+
+    def test_record_reads_bodies_outside_the_lock(self):
+        """Verify a body is read before the sidecar is locked to append it."""
+        self.store.sidecar_path = os.path.join(self.cassette_dir,
+                                               'c.json.bodies')
+        locked = []
+        body = io.BytesIO(b'body')
+        read = body.read
+
+        def read_body(size):
+            locked.append(self.store._sidecar_lock.locked())
+            return read(size)
+
+        body.read = read_body
+        assert self.store.record(body) == ({'offset': 0, 'length': 4}, None)
+        assert locked == [False, False]
+        with open(self.store.sidecar_path, 'rb') as fd:
+            assert fd.read() == b'body'
+
+    def test_sidecar_map_is_released(self):
+        """Verify the store keeps one memory map and lets go of it."""
+        self.store.sidecar_path = os.path.join(self.cassette_dir,
+                                               'c.json.bodies')
+        first = self.store.sidecar_body({'encoding': None, 'bytes': b'one'})
+        reader = self.store.open(first)
+        mapped = self.store._sidecar_map[1]
+        self.store.sidecar_body({'encoding': None, 'bytes': b'two'})
+        assert self.store.open(first).read() == b'one'
+        assert self.store._sidecar_map[1] is mapped
+        assert self.store.open({'offset': 3, 'length': 3}).read() == b'two'
+        assert self.store._sidecar_map[1] is not mapped
+        # The first map is still read from
+        assert mapped.closed is False
+        assert reader.read() == b'one'
+        reader.close()
+
+        self.store.close()
+        assert self.store._sidecar_map is None
+        self.store.open(first).close()
+        self.store.rewrite_sidecar([{'offset': 3, 'length': 3}])
+        assert self.store._sidecar_map is None
+
+    def test_rewrite_sidecar(self):
+        """Verify only the bodies still referred to are kept."""
+        self.store.sidecar_path = os.path.join(self.cassette_dir,
+                                               'c.json.bodies')
+        assert self.store.rewrite_sidecar([]) is None
+        with open(self.store.sidecar_path, 'wb') as fd:
+            fd.write(b'oldfirstfirst')
+        first = {'encoding': 'utf-8', 'offset': 3, 'length': 5}
+        again = {'encoding': 'utf-8', 'offset': 8, 'length': 5}
+        moved = self.store.rewrite_sidecar([first, again, 'old style body'])
+        assert moved == {(3, 5): 0, (8, 5): 0}
+        with open(self.store.sidecar_path, 'rb') as fd:
+            assert fd.read() == b'first'
+        assert blobs.relocated(again, moved) == dict(again, offset=0)
+        assert self.store.sidecar_body(
+            {'encoding': 'utf-8', 'string': 'first'})['offset'] == 0
+
+        assert self.store.rewrite_sidecar([{'offset': 0,
+                                            'length': 5}]) is None
+        assert self.store.rewrite_sidecar([]) == {}
+        assert not os.path.exists(self.store.sidecar_path)
+
+    def test_body_reader_reads_into_buffers(self):
+        """Verify the reader works for buffered and chunked reads."""
+        reader = blobs.BodyReader(memoryview(b'x' * 10000))
+        assert len(io.BufferedReader(reader, 4096).read()) == 10000
+        reader = blobs.BodyReader(memoryview(b'abc'))
+        buffer = bytearray(2)
+        assert reader.readinto(buffer) == 2
+        assert buffer == b'ab'
+
+    def test_collect_garbage_reads_compressed_cassettes(self):
+        """Verify references in compressed cassettes are found."""
+        kept = self.store.put(b'kept')
+        removed = self.store.put(b'removed')
+        serializer = serializers.serializer_registry['json+gz']
+        with open(os.path.join(self.cassette_dir, 'c.json.gz'), 'wb') as fd:
+            fd.write(serializer.serialize({'sha256': kept}))
+        assert blobs.collect_garbage(self.cassette_dir) == [removed]
+        assert self.store.get(kept) == b'kept'
+
 
 class Serializer(base.BaseSerializer):
     """Serializer to test NotImplementedError exceptions."""
@@ -78,6 +817,15 @@ class TestBaseSerializer(unittest.TestCase):
         with pytest.raises(ValueError):
             base.BaseSerializer()
 
+    def test_dump_and_load_use_the_string_api(self):
+        """Verify the file object methods fall back to (de)serialize."""
+        serializer = BytesSerializer()
+        fileobj = io.BytesIO()
+        serializer.dump({}, fileobj)
+        assert fileobj.getvalue() == BytesSerializer.serialized_bytes
+        fileobj.seek(0)
+        assert serializer.load(fileobj) == BytesSerializer.serialized_bytes
+
 
 class TestBinarySerializers(unittest.TestCase):
     """Verify the behaviour of stored_as_binary=True."""
@@ -125,3 +873,192 @@ class TestTextSerializer(unittest.TestCase):
         """Verify we use the right mode with open()."""
         mode = self.proxy.corrected_file_mode('r')
         assert mode == 'r'
+
+
+class TestSerializerProxy(unittest.TestCase):
+    """Verify how the proxy writes cassettes."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_path = str(tmpdir.join('cassette.json'))
+        self.proxy = proxy.SerializerProxy(
+            json_serializer.JSONSerializer(),
+            self.cassette_path,
+            allow_serialization=True,
+        )
+
+    def test_serialize_replaces_the_file(self):
+        """Verify we only leave the cassette behind."""
+        self.proxy.serialize({'http_interactions': []})
+        self.proxy.serialize({'http_interactions': [], 'recorded_with': ''})
+        directory = os.path.dirname(self.cassette_path)
+        assert os.listdir(directory) == ['cassette.json']
+        assert self.proxy.deserialize() == {
+            'http_interactions': [], 'recorded_with': ''
+        }
+
+    def test_serialize_keeps_the_file_mode(self):
+        """Verify the cassette keeps its permissions."""
+        open(self.cassette_path, 'w').close()
+        os.chmod(self.cassette_path, 0o640)
+        self.proxy.serialize({'http_interactions': []})
+        assert os.stat(self.cassette_path).st_mode & 0o777 == 0o640
+
+    def test_uses_the_file_object_methods(self):
+        """Verify the proxy prefers dump and load."""
+        class StreamingSerializer(json_serializer.JSONSerializer):
+            def serialize(self, cassette_data):
+                raise AssertionError('dump should be used')
+
+            def deserialize(self, cassette_data):
+                raise AssertionError('load should be used')
+
+            def dump(self, cassette_data, fileobj):
+                json.dump(cassette_data, fileobj)
+
+            def load(self, fileobj):
+                return json.load(fileobj)
+
+        self.proxy.proxied_serializer = StreamingSerializer()
+        self.proxy.serialize({'http_interactions': []})
+        assert self.proxy.deserialize() == {'http_interactions': []}
+
+    def test_failed_serialize_keeps_the_old_file(self):
+        """Verify a failure does not truncate the cassette."""
+        self.proxy.serialize({'http_interactions': []})
+        with pytest.raises(TypeError):
+            self.proxy.serialize({'http_interactions': [object()]})
+        directory = os.path.dirname(self.cassette_path)
+        assert os.listdir(directory) == ['cassette.json']
+        assert self.proxy.deserialize() == {'http_interactions': []}
+
+
+    def test_append_drops_an_incomplete_last_line(self):
+        """Verify appending does not leave a torn line behind."""
+        self.proxy.append({'a': 1})
+        with open(self.proxy.journal_path, 'a') as fd:
+            fd.write('{"b": ')
+        assert self.proxy.read_journal() == [{'a': 1}]
+        self.proxy.append({'c': 3})
+        assert self.proxy.read_journal() == [{'a': 1}, {'c': 3}]
+
+        with open(self.proxy.journal_path, 'a') as fd:
+            fd.write('{"d": 4}')
+        self.proxy.append({'e': 5})
+        assert self.proxy.read_journal() == [
+            {'a': 1}, {'c': 3}, {'d': 4}, {'e': 5}]
+
+        with open(self.proxy.journal_path, 'a') as fd:
+            fd.write('{"f": \n')
+        with pytest.raises(ValueError):
+            self.proxy.read_journal()
+
+
+class TestCassetteCache(unittest.TestCase):
+    """Verify the on-disk cache of deserialized cassettes."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cassette_path = str(tmpdir.join('cassette.json'))
+        self.cache = cache.CassetteCache(str(tmpdir.join('cache')))
+        self.data = {'http_interactions': [{'a': 1}], 'recorded_with': ''}
+        with open(self.cassette_path, 'w') as fd:
+            json.dump(self.data, fd)
+
+    def test_missing_entry(self):
+        """Verify there is nothing cached at first."""
+        assert self.cache.load(self.cassette_path, 'json') is None
+
+    def test_fresh_entry(self):
+        """Verify stored data is loaded while the cassette is unchanged."""
+        self.cache.store(self.cassette_path, 'json', self.data)
+        assert self.cache.load(self.cassette_path, 'json') == self.data
+        assert self.cache.load(self.cassette_path, 'jsonl') is None
+
+    def test_entry_survives_new_modification_times(self):
+        """Verify the contents are compared when the mtime changes."""
+        self.cache.store(self.cassette_path, 'json', self.data)
+        stat = os.stat(self.cassette_path)
+        os.utime(self.cassette_path, ns=(stat.st_atime_ns,
+                                         stat.st_mtime_ns + 10 ** 9))
+        assert self.cache.load(self.cassette_path, 'json') == self.data
+
+    def test_modified_cassette_is_stale(self):
+        """Verify changed contents invalidate the entry."""
+        self.cache.store(self.cassette_path, 'json', self.data)
+        stat = os.stat(self.cassette_path)
+        with open(self.cassette_path, 'w') as fd:
+            json.dump({'http_interactions': [{'b': 1}],
+                       'recorded_with': ''}, fd)
+        os.utime(self.cassette_path, ns=(stat.st_atime_ns,
+                                         stat.st_mtime_ns + 10 ** 9))
+        assert self.cache.load(self.cassette_path, 'json') is None
+
+    def test_corrupt_entry_is_ignored(self):
+        """Verify a damaged entry is treated as missing."""
+        self.cache.store(self.cassette_path, 'json', self.data)
+        with open(self.cache.entry_path(self.cassette_path), 'wb') as fd:
+            fd.write(b'garbage')
+        assert self.cache.load(self.cassette_path, 'json') is None
+
+    def test_unpicklable_data_is_not_cached(self):
+        """Verify data such as memoryviews is simply not cached."""
+        self.cache.store(self.cassette_path, 'json', {'a': memoryview(b'')})
+        assert self.cache.load(self.cassette_path, 'json') is None
+
+    def test_proxy_uses_the_cache(self):
+        """Verify the proxy skips deserializing cached cassettes."""
+        serializer_proxy = proxy.SerializerProxy(
+            json_serializer.JSONSerializer(), self.cassette_path)
+        serializer_proxy.cache = self.cache
+        assert serializer_proxy.deserialize() == self.data
+
+        serializer_proxy.proxied_serializer.load = None
+        assert serializer_proxy.deserialize() == self.data
+
+
+class TestMemoryCache(unittest.TestCase):
+    """Verify the in-memory cache of deserialized cassettes."""
+
+    def setUp(self):
+        """Fixture setup."""
+        self.cache = cache.MemoryCache(max_entries=2, max_bytes=100)
+
+    def test_get_requires_the_same_key(self):
+        """Verify entries are only returned for the key they were put with."""
+        self.cache.put('a', 1, {'a': 1}, 10)
+        assert self.cache.get('a', 1) == {'a': 1}
+        assert self.cache.get('a', 2) is None
+        assert self.cache.get('b', 1) is None
+
+    def test_evicts_least_recently_used(self):
+        """Verify the least recently used entry is evicted first."""
+        self.cache.put('a', 1, {'a': 1}, 10)
+        self.cache.put('b', 1, {'b': 1}, 10)
+        self.cache.get('a', 1)
+        self.cache.put('c', 1, {'c': 1}, 10)
+        assert self.cache.get('b', 1) is None
+        assert self.cache.get('a', 1) == {'a': 1}
+        assert self.cache.get('c', 1) == {'c': 1}
+
+    def test_evicts_to_stay_below_max_bytes(self):
+        """Verify the total size of the cassettes is capped."""
+        self.cache.put('a', 1, {'a': 1}, 60)
+        self.cache.put('b', 1, {'b': 1}, 60)
+        assert len(self.cache) == 1
+        self.cache.put('c', 1, {'c': 1}, 101)
+        assert self.cache.get('c', 1) is None
+        assert self.cache.get('b', 1) == {'b': 1}
+
+    def test_replacing_an_entry(self):
+        """Verify putting a path again replaces its entry."""
+        self.cache.put('a', 1, {'a': 1}, 60)
+        self.cache.put('a', 2, {'a': 2}, 60)
+        assert len(self.cache) == 1
+        assert self.cache.get('a', 2) == {'a': 2}
+
+    def test_disabled(self):
+        """Verify nothing is cached without entries."""
+        self.cache.max_entries = 0
+        self.cache.put('a', 1, {'a': 1}, 10)
+        assert self.cache.get('a', 1) is None